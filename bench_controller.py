@@ -0,0 +1,101 @@
+import argparse
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+import controller
+from person_tracker import SlotTracker
+from recording import read_recording
+from telemetry import RingStats
+
+
+def memory_mb():
+    """returns (current, peak) resident memory of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports the peak in KB, macOS in bytes
+    peak /= 1024 ** 2 if sys.platform == 'darwin' else 1024
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except OSError:
+        current = float('nan')
+    return current, peak
+
+
+def print_stats(name, stats):
+    p50, p90, p99 = stats.percentiles() * 1000
+    print(f"{name:>12} {stats.count:>7} {p50:>8.2f} {p90:>8.2f} {p99:>8.2f} {stats.values().max() * 1000:>8.2f}")
+
+
+def bench_pipeline(args):
+    """runs every frame of a recorded source through the full tracking pipeline"""
+    controller.start_model_loading(args.backend, args.imgsz, args.threads)
+    start = time.perf_counter()
+    controller.get_model()
+    print(f"model ready in {time.perf_counter() - start:.2f} s, memory {memory_mb()[0]:.0f} MB")
+
+    start = time.perf_counter()
+    pipeline = controller.run_tracking(
+        headless=True, budget=args.budget, slots=args.slots, source=args.source, realtime=False, lossless=True,
+    )
+    elapsed = time.perf_counter() - start
+
+    frames = controller.frame_latency.count
+    print(f"{frames} frames in {elapsed:.2f} s, {frames / elapsed:.1f} fps")
+    print(f"{'stage':>12} {'samples':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, stats in pipeline.timings.items():
+        print_stats(name, stats)
+    print_stats('end to end', controller.frame_latency)
+
+
+def bench_replay(args):
+    """times the post-processing alone on a keypoint recording, no model involved"""
+    frames = list(read_recording(args.replay))
+    if not frames:
+        raise ValueError(f"{args.replay} has no frames")
+    people = np.array([len(poses) for _, poses in frames])
+    print(f"{len(frames)} frames, {people.mean():.1f} people per frame on average (max {people.max()})")
+
+    timings = RingStats(max(len(frames), 1) * args.repeat)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        tracker = SlotTracker(args.slots) if args.slots else None
+        for recorded_at, poses in frames:
+            frame_start = time.perf_counter()
+            controller.slot_hands(poses, tracker, recorded_at)
+            timings.add(time.perf_counter() - frame_start)
+    elapsed = time.perf_counter() - start
+
+    print(f"{timings.count / elapsed:.0f} fps")
+    print(f"{'stage':>12} {'samples':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    print_stats('postprocess', timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the tracking pipeline offline")
+    parser.add_argument("source", nargs="?", help="video file or image directory to track")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="time only the post-processing, on a keypoint recording made with main.py --record")
+    parser.add_argument("--backend", choices=("torch", "onnx", "openvino"))
+    parser.add_argument("--imgsz", type=int)
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--budget", type=float)
+    parser.add_argument("--slots", type=int, default=None, help="people to give stable slots to (default: off)")
+    parser.add_argument("--repeat", type=int, default=20, help="passes over the recording with --replay")
+    args = parser.parse_args()
+    if not args.source and not args.replay:
+        parser.error("give a source to track or --replay FILE")
+
+    if args.replay:
+        bench_replay(args)
+    else:
+        bench_pipeline(args)
+    current, peak = memory_mb()
+    print(f"memory: {current:.0f} MB now, {peak:.0f} MB peak")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+
+import numpy as np
+
+from bench_mixer import make_player, time_callback
+
+
+def moving_callback(player, rng, output, frames):
+    """runs the callback with every hand moving, so the coefficients are recomputed each block"""
+    player.set_filter_positions(rng.uniform(0, 1, player.n_tracks))
+    player._audio_callback(output, frames, None, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the callback with a filter on every stem")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[2, 4, 8, 16, 24, 32])
+    parser.add_argument("--blocks", type=int, nargs="+", default=[128, 256, 512, 1024])
+    parser.add_argument("--mode", choices=("lowpass", "bandpass"), default="lowpass")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'tracks':>6} {'block':>6} {'deadline us':>12} {'off us':>9} {'on us':>9} "
+          f"{'moving us':>10} {'worst us':>9} {'deadline':>9}")
+    for n_tracks in args.tracks:
+        player = make_player(n_tracks, args.seconds, args.sample_rate)
+        for block_size in args.blocks:
+            deadline = block_size / args.sample_rate * 1e6
+            for index in range(n_tracks):
+                player.set_filter(index, None)
+            player.pos = 0
+            off_mean, _ = time_callback(
+                lambda out, frames: player._audio_callback(out, frames, None, None),
+                player, block_size, args.iterations,
+            )
+
+            for index in range(n_tracks):
+                player.set_filter(index, args.mode)
+            player.pos = 0
+            on_mean, _ = time_callback(
+                lambda out, frames: player._audio_callback(out, frames, None, None),
+                player, block_size, args.iterations,
+            )
+            player.pos = 0
+            moving_mean, worst = time_callback(
+                lambda out, frames: moving_callback(player, rng, out, frames),
+                player, block_size, args.iterations,
+            )
+            print(f"{n_tracks:>6} {block_size:>6} {deadline:>12.0f} {off_mean:>9.1f} {on_mean:>9.1f} "
+                  f"{moving_mean:>10.1f} {worst:>9.1f} {moving_mean / deadline:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import time
+
+import numpy as np
+
+from controller import extract_keypoints, get_hand_heights, compute_hand_positions
+
+
+class FakeTensor:
+    """stands in for a torch tensor, so the benchmark runs without a model"""
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class FakeKeypoints:
+    def __init__(self, data):
+        self.data = FakeTensor(data)
+        self.xy = FakeTensor(data[..., :2])
+
+
+class FakeResult:
+    def __init__(self, data):
+        self.keypoints = FakeKeypoints(data)
+
+
+def legacy_extract_keypoints(result, frame_width, frame_height):
+    """the old dict-per-person extraction, kept here as the baseline to compare against"""
+    keypoints_array = result.keypoints.xy.cpu().numpy()
+    normalized_keypoints = []
+    for person_kps in keypoints_array:
+        person = {'keypoints': {}}
+        for i in range(person_kps.shape[0]):
+            x, y = person_kps[i]
+            person['keypoints'][f'kp_{i}'] = (x / frame_width, y / frame_height)
+        normalized_keypoints.append(person)
+    return normalized_keypoints
+
+
+def legacy_hand_heights(tracked_objects, frame_width, frame_height):
+    """the old compute_hand_positions + get_hand_heights pair"""
+    hand_heights = []
+    for obj in tracked_objects:
+        keypoints = obj['keypoints']
+        for name in ('kp_9', 'kp_10'):
+            x, y = keypoints[name]
+            hand_px = (int(x * frame_width), int(y * frame_height))
+            hand_heights.append(1 - hand_px[1] / frame_height)
+    return hand_heights
+
+
+def time_per_frame(function, iterations):
+    """returns the mean time per call in microseconds"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark keypoint post-processing")
+    parser.add_argument("--people", type=int, nargs="+", default=[1, 2, 5, 10, 20])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'people':>6} {'dicts us':>9} {'arrays us':>10} {'speedup':>8}")
+    for people in args.people:
+        data = rng.uniform(0, 1, (people, 17, 3)).astype(np.float32)
+        data[..., 0] *= args.width
+        data[..., 1] *= args.height
+        result = FakeResult(data)
+
+        def legacy():
+            tracked_objects = legacy_extract_keypoints(result, args.width, args.height)
+            legacy_hand_heights(tracked_objects, args.width, args.height)
+
+        def vectorized():
+            poses = extract_keypoints(result, args.width, args.height)
+            get_hand_heights(poses)
+            compute_hand_positions(poses, args.width, args.height)
+
+        legacy_us = time_per_frame(legacy, args.iterations)
+        vectorized_us = time_per_frame(vectorized, args.iterations)
+        print(f"{people:>6} {legacy_us:>9.1f} {vectorized_us:>10.1f} {legacy_us / vectorized_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
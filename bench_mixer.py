@@ -0,0 +1,103 @@
+import argparse
+import time
+
+import numpy as np
+
+from mixer3 import SimultaneousWAVPlayer
+
+
+def legacy_mix(player, output, frames):
+    """the old list-of-copies mix, kept here as the baseline to compare against"""
+    end = player.pos + frames
+    chunks = [player.data[i, player.pos:end] * player.gains[i] for i in range(player.n_tracks)]
+    mixed_chunk = np.sum(chunks, axis=0)
+    output[: len(mixed_chunk)] = mixed_chunk
+    if len(mixed_chunk) < len(output):
+        output[len(mixed_chunk) :] = 0
+    player.pos = end if end < player.max_length else 0
+
+
+def ramping_callback(player, output, frames):
+    """runs the callback with every track mid-glide, so the per-sample gain ramp is always taken"""
+    player._current_gains.fill(0)
+    player._audio_callback(output, frames, None, None)
+
+
+def make_player(n_tracks, seconds, sample_rate, outputs=None):
+    """
+    builds a player from random noise stems
+
+    :param n_tracks: number of stems
+    :param seconds: length of each stem
+    :param sample_rate: sample rate of the stems
+    :param outputs: pan the stems across this many outputs, None for stereo
+    """
+    rng = np.random.default_rng(0)
+    frames = int(seconds * sample_rate)
+    stems = [rng.uniform(-0.1, 0.1, (frames, 2)).astype(np.float32) for _ in range(n_tracks)]
+    player = SimultaneousWAVPlayer.from_arrays(stems, sample_rate, outputs=outputs)
+    for i in range(n_tracks):
+        player.gains[i] = rng.uniform(0.1, 1)
+    if outputs is not None:
+        player.set_pan_positions(rng.uniform(0, 1, n_tracks))
+    player._gain_targets(player._current_gains)
+    return player
+
+
+def time_callback(mix, player, block_size, iterations):
+    """
+    returns the mean and worst time per block in microseconds
+
+    :param mix: function called as mix(output, frames)
+    """
+    output = np.zeros((block_size, player.outputs), dtype=np.float32)
+    times = np.empty(iterations)
+    for i in range(iterations):
+        start = time.perf_counter()
+        mix(output, block_size)
+        times[i] = time.perf_counter() - start
+    return times.mean() * 1e6, times.max() * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the mixer callback")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[2, 4, 8, 12, 16, 24, 32])
+    parser.add_argument("--blocks", type=int, nargs="+", default=[64, 128, 256, 512, 1024])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--outputs", type=int, help="time the spatial mix across this many outputs instead of stereo")
+    args = parser.parse_args()
+
+    print(f"{'tracks':>6} {'block':>6} {'deadline us':>12} {'mean us':>9} {'max us':>9} "
+          f"{'ramp us':>9} {'legacy us':>10} {'speedup':>8}")
+    for n_tracks in args.tracks:
+        player = make_player(n_tracks, args.seconds, args.sample_rate, args.outputs)
+        for block_size in args.blocks:
+            deadline = block_size / args.sample_rate * 1e6
+            player.pos = 0
+            mean, worst = time_callback(
+                lambda out, frames: player._audio_callback(out, frames, None, None),
+                player, block_size, args.iterations,
+            )
+            player.pos = 0
+            ramp_mean, _ = time_callback(
+                lambda out, frames: ramping_callback(player, out, frames),
+                player, block_size, args.iterations,
+            )
+            player._gain_targets(player._current_gains)
+            player.pos = 0
+            if args.outputs is None:
+                legacy_mean, _ = time_callback(
+                    lambda out, frames: legacy_mix(player, out, frames),
+                    player, block_size, args.iterations,
+                )
+            else:
+                # the old mix only ever did stereo
+                legacy_mean = float('nan')
+            print(f"{n_tracks:>6} {block_size:>6} {deadline:>12.0f} {mean:>9.1f} {worst:>9.1f} "
+                  f"{ramp_mean:>9.1f} {legacy_mean:>10.1f} {legacy_mean / mean:>7.1f}{'x' if args.outputs is None else ' '}")
+
+
+if __name__ == "__main__":
+    main()
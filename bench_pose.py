@@ -0,0 +1,70 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from pose_backend import BACKENDS, DEFAULT_WEIGHTS, PoseModel
+
+
+def read_clip(path, max_frames):
+    """
+    reads up to max_frames frames of a video into memory, so decoding isn't part of the timing
+
+    :param path: path to a recorded clip
+    :param max_frames: frames to keep
+    """
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise ValueError(f"No frames could be read from {path}")
+    return frames
+
+
+def bench_backend(frames, backend, weights, imgsz, threads, warmup):
+    """
+    runs every frame through one backend
+
+    :return: per-frame latencies in seconds
+    """
+    model = PoseModel(weights, backend, imgsz, threads)
+    for frame in frames[:warmup]:
+        model(frame)
+    latencies = np.empty(len(frames))
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        model(frame)
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare pose inference backends on a recorded clip")
+    parser.add_argument("clip", help="video file to run the model on")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--weights", default=DEFAULT_WEIGHTS)
+    parser.add_argument("--imgsz", type=int, nargs="+", default=[640])
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=10)
+    args = parser.parse_args()
+
+    frames = read_clip(args.clip, args.frames)
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}, threads: {args.threads or 'default'}")
+    print(f"{'backend':>9} {'imgsz':>6} {'fps':>7} {'mean ms':>8} {'p50 ms':>7} {'p90 ms':>7} {'p99 ms':>7}")
+    for backend in args.backends:
+        for imgsz in args.imgsz:
+            latencies = bench_backend(frames, backend, args.weights, imgsz, args.threads, args.warmup) * 1000
+            p50, p90, p99 = np.percentile(latencies, (50, 90, 99))
+            print(f"{backend:>9} {imgsz:>6} {1000 / latencies.mean():>7.1f} {latencies.mean():>8.1f} "
+                  f"{p50:>7.1f} {p90:>7.1f} {p99:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
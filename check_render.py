@@ -0,0 +1,115 @@
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+from mixer3 import SimultaneousWAVPlayer
+
+# (name, settings for the player), every case is rendered and played and must come out the same
+CASES = (
+    ('stereo', {}),
+    ('streaming', {'streaming': True}),
+    ('crossfade', {'crossfade': 0.05}),
+    ('loop lengths', {'streaming': True, 'crossfade': 0.02, 'loop_lengths': [30000, None, 22000, 41000]}),
+    ('outputs', {'outputs': 6, 'crossfade': 0.02}),
+    ('outputs streaming', {'streaming': True, 'outputs': 3, 'pan_law': 'linear',
+                           'loop_lengths': [None, 25000, None, 33000]}),
+)
+
+
+def make_stems(directory, n_tracks, seconds, sample_rate):
+    """writes noise stems of slightly different lengths, some mono, and returns their paths"""
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(n_tracks):
+        frames = int(seconds * sample_rate) + i * 1000
+        shape = (frames,) if i % 2 else (frames, 2)
+        path = os.path.join(directory, f"stem{i}.wav")
+        sf.write(path, rng.uniform(-0.5, 0.5, shape).astype(np.float32), sample_rate, subtype='FLOAT')
+        paths.append(path)
+    return paths
+
+
+def make_automation(n_tracks, duration, seed=1):
+    """(seconds, levels) pairs with bursts of changes and quiet stretches in between"""
+    rng = np.random.default_rng(seed)
+    times = np.sort(np.concatenate([
+        rng.uniform(0, duration * 0.2, 8),
+        rng.uniform(duration * 0.6, duration * 0.7, 8),
+    ]))
+    return [(float(t), list(rng.uniform(0, 1, n_tracks))) for t in times]
+
+
+def make_player(paths, settings, sample_rate):
+    player = SimultaneousWAVPlayer(paths, sample_rate=sample_rate, **settings)
+    player.set_volumes([0.5] * player.n_tracks)
+    if player.pan is not None:
+        player.set_pan_positions(np.linspace(0, 1, player.n_tracks))
+    player.set_filter(1, 'lowpass')
+    player.set_filter_positions([np.nan, 0.3])
+    return player
+
+
+def play_blocks(player, duration, automation, blocksize):
+    """what the stream would play: the callback block by block, each change at the first block boundary after it"""
+    total = int(round(duration * player.sample_rate))
+    player.pos = 0
+    player._gain_targets(player._current_gains)
+    events = list(automation)
+    blocks = []
+    for start in range(0, total, blocksize):
+        while events and int(round(events[0][0] * player.sample_rate)) <= start:
+            player.set_volumes(events.pop(0)[1])
+        count = min(blocksize, total - start)
+        output = np.zeros((count, player.outputs), dtype=np.float32)
+        player._audio_callback(output, count, None, None)
+        blocks.append(output)
+    return np.concatenate(blocks)
+
+
+def check(paths, settings, duration, blocksize, sample_rate):
+    """returns the largest difference between the offline render and the played blocks"""
+    automation = make_automation(len(paths), duration)
+    rendered = np.concatenate([
+        block.copy() for block in make_player(paths, settings, sample_rate).render_blocks(
+            duration, automation, blocksize,
+        )
+    ])
+    played = play_blocks(make_player(paths, settings, sample_rate), duration, automation, blocksize)
+    if rendered.shape != played.shape:
+        return np.inf
+    return float(np.abs(rendered - played).max())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="check that offline renders are bit-identical to what the callback plays",
+    )
+    parser.add_argument("--tracks", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=1.0, help="length of the shortest stem")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds rendered, several loops")
+    parser.add_argument("--blocks", type=int, nargs="+", default=[256, 441, 1024])
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_stems(directory, args.tracks, args.seconds, args.sample_rate)
+        for name, settings in CASES:
+            if 'loop_lengths' in settings:
+                # one per stem, however many there are
+                loop_lengths = (settings['loop_lengths'] + [None] * args.tracks)[:args.tracks]
+                settings = dict(settings, loop_lengths=loop_lengths)
+            for blocksize in args.blocks:
+                difference = check(paths, settings, args.duration, blocksize, args.sample_rate)
+                ok = difference == 0
+                failed |= not ok
+                print(f"{name:>18} block {blocksize:>5}: {'ok' if ok else f'differs by {difference:.3g}'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,154 +1,344 @@
-from ultralytics import YOLO
 import cv2
 import numpy as np
+import logging
+import os
 import threading
-import queue
+import time
 
-model = YOLO('yolo11n-pose.pt')
-hand_heights_queue = queue.Queue()
+from snapshot import LatestSnapshot
+from overlay import PreviewRenderer
+from pipeline import Pipeline
+from poses import HANDS, MIN_CONFIDENCE, empty_poses
+from scheduler import AdaptiveScheduler
+from person_tracker import SlotTracker
+from recording import KeypointRecorder, read_recording
+from sources import open_source
+from telemetry import RingStats
+from rtlog import setup_logging
+
+log = logging.getLogger(__name__)
+
+# seconds between pipeline timing reports
+REPORT_EVERY = 30
+
+# the pose model is built on a background thread, see start_model_loading
+_model = None
+_model_error = None
+_model_loaded = threading.Event()
+_model_lock = threading.Lock()
+_model_loading = False
+# seconds spent in each phase of getting the model ready
+startup_timings = {}
+# only the newest frame's hand heights are kept, readers never fall behind
+hand_snapshots = LatestSnapshot()
+# seconds from frame capture to its hand heights being published
+frame_latency = RingStats()
+
+def _load_model(backend, imgsz, threads):
+    global _model, _model_error
+    try:
+        start = time.perf_counter()
+        # pulls in torch and ultralytics, which is most of the import time
+        from pose_backend import PoseModel
+        startup_timings['model import'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        model = PoseModel(backend=backend, imgsz=imgsz, threads=threads)
+        startup_timings['model load'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        model.warmup()
+        startup_timings['model warm-up'] = time.perf_counter() - start
+        _model = model
+    except Exception as error:
+        _model_error = error
+        log.exception("Failed to load the pose model")
+    finally:
+        _model_loaded.set()
+
+def start_model_loading(backend=None, imgsz=None, threads=None):
+    """
+    starts building and warming up the pose model on a background thread and returns right away
+    
+    only the first call does anything, settings left as None come from the
+    POSE_BACKEND (torch, onnx or openvino), POSE_IMGSZ and POSE_THREADS environment variables
+    
+    :param backend: inference runtime, see pose_backend.BACKENDS
+    :param imgsz: inference resolution
+    :param threads: CPU threads inference may use
+    """
+    global _model_loading
+    with _model_lock:
+        if _model_loading:
+            return
+        _model_loading = True
+
+    settings = {
+        'backend': backend or os.environ.get('POSE_BACKEND', 'torch'),
+        'imgsz': imgsz or int(os.environ.get('POSE_IMGSZ', 640)),
+        'threads': threads or int(os.environ.get('POSE_THREADS', 0)) or None,
+    }
+    threading.Thread(target=_load_model, kwargs=settings, name='model-loader', daemon=True).start()
+
+def get_model():
+    """returns the pose model, waiting for it to finish loading (and starting the load if nobody did)"""
+    start_model_loading()
+    _model_loaded.wait()
+    if _model is None:
+        raise RuntimeError("The pose model failed to load") from _model_error
+    return _model
 
 def track_objects_in_frame(frame):
-    results = model(frame)
+    return collect_poses(get_model()(frame), frame)
 
-    tracked_objects = []
-    for result in results:
-        normalized_keypoints = extract_keypoints(result, frame.shape[1], frame.shape[0])
-        if normalized_keypoints:
-            tracked_objects.extend(normalized_keypoints)
+def collect_poses(results, frame):
+    """
+    turns the model output for frame into one (N, 17, 3) array of people, see poses.py
+    """
+    poses = [extract_keypoints(result, frame.shape[1], frame.shape[0]) for result in results]
+    poses = np.concatenate(poses) if poses else empty_poses()
     
-    print("Tracked Objects Structure:", tracked_objects)
+    log.debug("Tracked poses: %s", poses)
     
-    return tracked_objects
-
-def get_hand_heights(tracked_objects):
-    hand_heights = []
-    for obj in tracked_objects:
-        left_hand, right_hand = obj.get('hand_positions', (0, 0))
-        frame_height = obj.get('frame_height', 1)
-        if left_hand:
-            height = 1 - (left_hand[1] / frame_height)
-            hand_heights.append(height)
-        else:
-            hand_heights.append(0)
-        if right_hand:
-            height = 1 - (right_hand[1] / frame_height)
-            hand_heights.append(height)
-        else:
-            hand_heights.append(0)
+    return poses
+
+def get_hand_heights(poses):
+    """
+    returns [L0, R0, L1, R1, ...], 1 at the top of the frame and 0 at the bottom
+    
+    hands the model isn't confident about count as 0
     
-    return hand_heights
+    :param poses: (N, 17, 3) array from extract_keypoints
+    """
+    hands = poses[:, HANDS]
+    return np.where(hands[..., 2] >= MIN_CONFIDENCE, 1 - hands[..., 1], 0).reshape(-1)
+
+def get_hand_x(poses):
+    """
+    returns [L0, R0, L1, R1, ...], 0 at the left edge of the frame and 1 at the right
+
+    hands the model isn't confident about are NaN, so whatever they control can stay where it was
+
+    :param poses: (N, 17, 3) array from extract_keypoints
+    """
+    hands = poses[:, HANDS]
+    return np.where(hands[..., 2] >= MIN_CONFIDENCE, hands[..., 0], np.nan).reshape(-1)
+
+def slot_hands(poses, tracker, now):
+    """
+    get_hand_heights and get_hand_x in the tracker's slot order, or the detector's order without a tracker
+
+    :param tracker: SlotTracker or None
+    :param now: time.monotonic() of the frame
+    :return: (hand heights, hand x positions)
+    """
+    hand_heights = get_hand_heights(poses)
+    hand_x = get_hand_x(poses)
+    if tracker is not None:
+        slots = tracker.update(poses, now)
+        hand_heights = tracker.arrange(hand_heights, slots)
+        hand_x = tracker.arrange(hand_x, slots, empty=np.nan)
+    return hand_heights, hand_x
 
-def run_tracking():
-    cap = cv2.VideoCapture(0)
-    while cap.isOpened():
+def run_tracking(headless=False, preview_fps=10, budget=None, slots=None, source=0, realtime=True,
+                 record=None, lossless=False, snapshots=None, append_record=False):
+    """
+    tracks hands from a camera or recorded footage and publishes hand heights until the source ends
+
+    capture, inference and post-processing each get a thread, so the camera is
+    read while the model runs and inference always starts on the newest frame
+    
+    :param headless: skip all drawing and don't open a preview window
+    :param preview_fps: how often the preview window redraws, when not headless
+    :param budget: share of the camera frame interval inference may use, see
+                   scheduler.AdaptiveScheduler. None runs the full model on every frame
+    :param slots: give each person a stable pair of hand heights, for at most this many
+                  people, see person_tracker.SlotTracker. None keeps the detector's order
+    :param source: camera index, video file or image directory, see sources.open_source
+    :param realtime: play video files and image directories at their frame rate, False reads them as fast as possible
+    :param record: path to save every frame's keypoints to, see recording.KeypointRecorder
+    :param lossless: process every frame instead of skipping to the newest one, for offline runs
+    :param snapshots: LatestSnapshot to publish to, defaults to hand_snapshots
+    :param append_record: carry on with the recording already at record instead of replacing it
+    :return: the finished Pipeline, for its timings
+    """
+    if snapshots is None:
+        snapshots = hand_snapshots
+    renderer = None
+    if not headless:
+        renderer = PreviewRenderer(snapshots, preview_fps)
+        renderer.start()
+
+    model = get_model()
+    cap = open_source(source, realtime)
+    # we read continuously, so the driver doesn't need to hold old frames for us
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def capture():
+        if not cap.isOpened():
+            return None
         ret, frame = cap.read()
         if not ret:
-            print("Failed to capture frame")
-            break
-        frame_height, frame_width = frame.shape[:2]
-        tracked_objects = track_objects_in_frame(frame)
-        
-        for obj in tracked_objects:
-            keypoints = obj['keypoints']
-            left_hand, right_hand = compute_hand_positions(keypoints, frame_width, frame_height)
-            obj['hand_positions'] = (left_hand, right_hand)
-            obj['frame_height'] = frame_height
-        
-        hand_heights = get_hand_heights(tracked_objects)
-        
-        hand_heights_queue.put(hand_heights)
-        
-        for obj in tracked_objects:
-            keypoints = obj['keypoints']
-            for kp_name, (x_norm, y_norm) in keypoints.items():
-                x_px = int(x_norm * frame_width)
-                y_px = int(y_norm * frame_height)
-                
-                # Draw each keypoint with a circle
-                cv2.circle(frame, (x_px, y_px), 5, (0, 255, 255), -1)
-                
-                # Label each keypoint
-                cv2.putText(frame, kp_name, (x_px + 5, y_px - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+            log.error("Failed to capture frame")
+            return None
+        return {'frame': frame, 'captured_at': time.monotonic()}
+
+    def detect(image, imgsz=None):
+        return collect_poses(model(image, imgsz), image)
+
+    scheduler = AdaptiveScheduler(detect, budget) if budget else None
+    tracker = SlotTracker(slots) if slots else None
+    recorder = KeypointRecorder(record, append_record) if record else None
+
+    def infer(item):
+        if scheduler is None:
+            item['poses'] = detect(item['frame'])
+        else:
+            item['poses'] = scheduler.process(item['frame'], item['captured_at'])
+        return item
+
+    def postprocess(item):
+        frame = item['frame']
+        poses = item['poses']
+        hand_heights, hand_x = slot_hands(poses, tracker, item['captured_at'])
+        if recorder is not None:
+            recorder.write(item['captured_at'], poses)
         
-        # Draw hand positions specifically (left hand: blue, right hand: red)
-        for obj in tracked_objects:
-            left_hand, right_hand = obj.get('hand_positions', (None, None))
-
-            if left_hand:
-                cv2.circle(frame, left_hand, 10, (255, 0, 0), -1)
-            if right_hand:
-                cv2.circle(frame, right_hand, 10, (0, 0, 255), -1)
-
-        # Draw bar graph for hand heights
-        bar_height = 100
-        bar_width = 30
-        gap = 10
-        start_x = 10
-        start_y = frame.shape[0] - 110
-
-        for i, height in enumerate(hand_heights):
-            bar_top = int(start_y + bar_height * (1 - height))
-
-            cv2.rectangle(frame, (start_x, start_y), (start_x + bar_width, bar_top), (0, 255, 0), -1)
-            cv2.rectangle(frame, (start_x, start_y), (start_x + bar_width, start_y + bar_height), (255, 255, 0), 2)
-
-            label = f"Ch {i+1}"
-            cv2.putText(frame, label, (start_x, start_y + bar_height + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            
-            value = f"{height:.2f}"
-            cv2.putText(frame, value, (start_x, bar_top - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            
-            start_x += bar_width + gap
-
-        cv2.imshow('Hand Tracking', frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+        if headless:
+            snapshots.publish(hand_heights, item['captured_at'], poses=poses, hand_x=hand_x)
+        else:
+            # the renderer draws from the snapshot on its own thread
+            snapshots.publish(hand_heights, item['captured_at'], frame, poses, hand_x)
+        frame_latency.add(time.monotonic() - item['captured_at'])
+
+    pipeline = Pipeline(
+        [('capture', capture), ('inference', infer), ('postprocess', postprocess)], lossless=lossless,
+    )
+    pipeline.start()
+
+    last_report = time.monotonic()
+    while not pipeline.join(timeout=0.2):
+        if renderer is not None and renderer.quit_requested.is_set():
+            pipeline.stop()
+        if time.monotonic() - last_report >= REPORT_EVERY:
+            log.info("Tracking pipeline:\n%s", pipeline.report())
+            if scheduler is not None:
+                log.info("Inference schedule: %s", scheduler.report())
+            last_report = time.monotonic()
+    log.info("Tracking pipeline:\n%s", pipeline.report())
+    if scheduler is not None:
+        log.info("Inference schedule: %s", scheduler.report())
 
     cap.release()
-    cv2.destroyAllWindows()
+    if recorder is not None:
+        recorder.close()
+    if renderer is not None:
+        renderer.stop()
+        renderer.join()
+    return pipeline
+
+def run_replay(path, speed=1.0, loop=False, slots=None):
+    """
+    publishes a keypoint recording's hand heights with the timing they were recorded at
+
+    stands in for run_tracking without a camera or the pose model, e.g. to try
+    the mixer or measure it against the same movement every time
+
+    :param path: recording made with run_tracking(record=...)
+    :param speed: playback rate, 2 replays twice as fast
+    :param loop: start over at the end instead of returning
+    :param slots: see run_tracking
+    """
+    while True:
+        tracker = SlotTracker(slots) if slots else None
+        start = time.monotonic()
+        first = None
+        for recorded_at, poses in read_recording(path):
+            if first is None:
+                first = recorded_at
+            time.sleep(max(0, start + (recorded_at - first) / speed - time.monotonic()))
+            now = time.monotonic()
+            hand_heights, hand_x = slot_hands(poses, tracker, now)
+            hand_snapshots.publish(hand_heights, now, poses=poses, hand_x=hand_x)
+        if not loop:
+            return
+
+def start_replay_thread(path, **settings):
+    """
+    runs run_replay on a daemon thread
+
+    :param settings: keyword arguments for run_replay
+    """
+    replay_thread = threading.Thread(target=run_replay, args=(path,), kwargs=settings, daemon=True)
+    replay_thread.start()
+    return replay_thread
 
 def extract_keypoints(result, frame_width, frame_height):
+    """
+    returns the people in one YOLO result as an (N, 17, 3) float32 array of
+    (x, y, confidence) with x and y normalized to 0-1
+    """
     keypoints = result.keypoints
-    if keypoints is not None:
-        keypoints_array = keypoints.xy.cpu().numpy()
-        normalized_keypoints = []
-        for person_kps in keypoints_array:
-            person = {'keypoints': {}}
-            for i in range(person_kps.shape[0]):
-                x, y = person_kps[i]
-                person['keypoints'][f'kp_{i}'] = (x / frame_width, y / frame_height)
-            normalized_keypoints.append(person)
-        return normalized_keypoints
-    return []
-
-def compute_hand_positions(keypoints, frame_width, frame_height):
-    left_hand = keypoints.get('kp_9', None)
-    right_hand = keypoints.get('kp_10', None)
-
-    if left_hand:
-        left_hand_px = (int(left_hand[0] * frame_width), int(left_hand[1] * frame_height))
-    else:
-        left_hand_px = None
-
-    if right_hand:
-        right_hand_px = (int(right_hand[0] * frame_width), int(right_hand[1] * frame_height))
-    else:
-        right_hand_px = None
-
-    return left_hand_px, right_hand_px
-
-def start_tracking_thread():
-    tracking_thread = threading.Thread(target=run_tracking)
+    if keypoints is None:
+        return empty_poses()
+    data = keypoints.data.cpu().numpy()
+    # models without keypoint confidences only give x and y, those count as fully confident
+    poses = np.ones((data.shape[0], data.shape[1], 3), dtype=np.float32)
+    poses[..., :data.shape[2]] = data
+    poses[..., :2] /= (frame_width, frame_height)
+    return poses
+
+def compute_hand_positions(poses, frame_width, frame_height):
+    """
+    returns an (N, 2, 2) int array with the pixel position of every left and right hand
+    
+    :param poses: (N, 17, 3) array from extract_keypoints
+    """
+    return (poses[:, HANDS, :2] * (frame_width, frame_height)).astype(int)
+
+def start_tracking_thread(**settings):
+    """
+    runs run_tracking on a daemon thread
+    
+    :param settings: keyword arguments for run_tracking
+    """
+    tracking_thread = threading.Thread(target=run_tracking, kwargs=settings)
     tracking_thread.daemon = True
     tracking_thread.start()
     return tracking_thread
 
-def get_current_hand_heights():
-    try:
-        return hand_heights_queue.get_nowait()
-    except queue.Empty:
+def get_current_hand_heights(max_age=None):
+    """
+    returns the newest hand heights
+    
+    :param max_age: seconds after which tracking data counts as stale and None is returned instead
+    """
+    snapshot = hand_snapshots.latest()
+    if snapshot is None:
+        return None
+    if max_age is not None and snapshot.age() > max_age:
         return None
+    return snapshot.hand_heights
+
+def get_latest_snapshot():
+    """returns the newest Snapshot (sequence number, capture time, hand heights) or None"""
+    return hand_snapshots.latest()
+
+def wait_for_snapshot(seq, timeout=None):
+    """
+    blocks until a frame newer than seq has been tracked
+    
+    :param seq: sequence number of the last snapshot already handled, 0 for none
+    :param timeout: seconds to wait at most
+    :return: the new Snapshot, or None on timeout
+    """
+    return hand_snapshots.wait_newer(seq, timeout)
+
+def get_snapshot_age():
+    """seconds since the newest tracked frame was captured, inf before the first one"""
+    return hand_snapshots.age()
 
 if __name__ == "__main__":
+    setup_logging()
     tracking_thread = start_tracking_thread()
     tracking_thread.join()
@@ -1,47 +1,163 @@
 from mixer3 import SimultaneousWAVPlayer
-from controller import start_tracking_thread, get_current_hand_heights
+from controller import (
+    start_tracking_thread, start_replay_thread, wait_for_snapshot, start_model_loading, get_model, startup_timings,
+)
+from stems import StemCache, format_timings
+from rtlog import setup_logging
+from telemetry import serve_metrics, write_metrics
+from vision_worker import VisionProcess
+from stem_watcher import StemWatcher, find_stems
+from spatial import PAN_LAWS
+import argparse
+import logging
 import time
-import os
+
+log = logging.getLogger(__name__)
+
+# tracking data older than this is treated as "no hands"
+STALE_AFTER = 0.5
+# seconds between latency reports
+REPORT_EVERY = 10
 
 def main():
+    parser = argparse.ArgumentParser(description="hand-tracked stem mixer")
+    parser.add_argument("--preview", type=float, metavar="FPS", default=0,
+                        help="show the tracking preview window at this rate (off by default)")
+    parser.add_argument("--backend", choices=("torch", "onnx", "openvino"),
+                        help="pose inference runtime (default: $POSE_BACKEND or torch)")
+    parser.add_argument("--imgsz", type=int, help="pose inference resolution (default: $POSE_IMGSZ or 640)")
+    parser.add_argument("--threads", type=int, help="CPU threads for pose inference (default: $POSE_THREADS)")
+    parser.add_argument("--budget", type=float,
+                        help="share of each camera frame inference may use, enables frame skipping, "
+                             "crop inference and keypoint prediction (default: full model every frame)")
+    parser.add_argument("--source", default="0",
+                        help="camera index, video file or directory of images to track (default: camera 0)")
+    parser.add_argument("--record", metavar="FILE", help="save the tracked keypoints of every frame to FILE")
+    parser.add_argument("--process", action="store_true",
+                        help="run tracking in its own process, so it can't hold up the audio callback")
+    parser.add_argument("--watch", action="store_true",
+                        help="switch to the new stems whenever SOUND ART files are added, removed or changed")
+    parser.add_argument("--swap-crossfade", type=float, default=1.0,
+                        help="seconds the old and new stems overlap when switching (default: 1)")
+    parser.add_argument("--filter", choices=("lowpass", "bandpass"),
+                        help="filter every stem, with the cutoff following its hand left to right")
+    parser.add_argument("--outputs", type=int,
+                        help="pan every stem across this many output channels, following its hand left to right "
+                             "(default: plain stereo)")
+    parser.add_argument("--pan-law", choices=tuple(PAN_LAWS), default="equal_power",
+                        help="how a stem is split between neighbouring outputs (default: equal_power)")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="drive the mixer from a recording made with --record, no camera or model needed")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve audio and latency metrics at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-file", metavar="FILE",
+                        help="rewrite FILE with the metrics in Prometheus text format every report")
+    parser.add_argument("--blocksize", type=int,
+                        help="audio frames per callback (default: the smallest this machine mixes safely)")
+    parser.add_argument("--latency", default="low",
+                        help="output latency in seconds, or low / high (default: low)")
+    parser.add_argument("--device", help="output device index or name (default: the system default)")
+    args = parser.parse_args()
+
+    setup_logging()
     keyword = "SOUND ART"
-    wav_files = [f for f in os.listdir('.') if f.endswith('.wav') and keyword in f]
+    # the same order the watcher reloads in, so every track index keeps its file across a switch
+    wav_files = find_stems('.', keyword)
     
     if not wav_files:
-        print("No WAV files found in the directory")
+        log.error("No WAV files found in the directory")
         return
 
-    player = SimultaneousWAVPlayer(wav_files)
-    
-    tracking_thread = start_tracking_thread()
+    start = time.perf_counter()
+    if not args.replay and not args.process:
+        # the model loads on its own thread while the stems load here
+        start_model_loading(args.backend, args.imgsz, args.threads)
+
+    cache = StemCache()
+    player = SimultaneousWAVPlayer(wav_files, streaming=True, cache=cache, outputs=args.outputs,
+                                   pan_law=args.pan_law)
+    stems_ready = time.perf_counter() - start
+    log.info("Stem load times:\n%s", format_timings(player.load_timings))
+    log.info(cache.report().splitlines()[-1])
     
-    player.play()
+    # silent until the first tracked frame arrives
+    player.set_volumes([])
+    if args.filter:
+        for index in range(player.n_tracks):
+            player.set_filter(index, args.filter)
+    device = int(args.device) if args.device and args.device.isdigit() else args.device
+    latency = args.latency if args.latency in ("low", "high") else float(args.latency)
+    player.play(blocksize=args.blocksize or 0, latency=latency, device=device, auto_tune=args.blocksize is None)
+    if args.metrics_port:
+        serve_metrics(player.metrics, args.metrics_port)
+    if args.watch:
+        StemWatcher(player, keyword=keyword, swap_crossfade=args.swap_crossfade, streaming=True, cache=cache).start()
     
+    # every person keeps the same two stems for as long as they're around
+    slots = (len(wav_files) + 1) // 2
+    # where hand heights come from, anything with wait_newer(seq, timeout)
+    wait_newer = wait_for_snapshot
+    vision = None
     try:
+        if args.replay:
+            start_replay_thread(args.replay, loop=True, slots=slots)
+            log.info("Startup: stems %.2f s | replaying %s", stems_ready, args.replay)
+        elif args.process:
+            # the model loads in the worker while we carry on
+            vision = VisionProcess(
+                max(slots, 1), args.backend, args.imgsz, args.threads,
+                headless=not args.preview, preview_fps=args.preview or 10, budget=args.budget,
+                slots=slots, source=args.source, record=args.record,
+            )
+            vision.start()
+            wait_newer = vision.wait_newer
+            log.info("Startup: stems %.2f s | tracking in a separate process", stems_ready)
+        else:
+            start_tracking_thread(
+                headless=not args.preview, preview_fps=args.preview or 10, budget=args.budget,
+                slots=slots, source=args.source, record=args.record,
+            )
+            get_model()
+            phases = ', '.join(f"{name} {seconds:.2f} s" for name, seconds in startup_timings.items())
+            log.info("Startup: stems %.2f s | %s | ready after %.2f s",
+                     stems_ready, phases, time.perf_counter() - start)
+
+        seq = 0
+        last_report = time.monotonic()
         while True:
-            hand_heights = get_current_hand_heights()
+            # wakes up as soon as the tracker publishes a frame, or after STALE_AFTER with nothing new
+            snapshot = wait_newer(seq, timeout=STALE_AFTER)
+            if snapshot is not None:
+                # even a stale one counts as seen, otherwise wait_newer hands it straight back forever
+                seq = snapshot.seq
             
-            if not hand_heights:
-                # Set all volumes to 0 if no hands are detected
-                for i in range(len(wav_files)):
-                    player.set_volume(i, 0)
+            if snapshot is None or snapshot.age() > STALE_AFTER:
+                # Set all volumes to 0 if no hands are detected (or tracking stalled)
+                player.set_volumes([])
             else:
-                # Adjust volume for detected hands
-                for i, height in enumerate(hand_heights):
-                    if i < len(wav_files):
-                        player.set_volume(i, height)
-                    else:
-                        break
-                    
-                # Mute any remaining tracks
-                for i in range(len(hand_heights), len(wav_files)):
-                    player.set_volume(i, 0)
-            
-            time.sleep(0.1)
+                # Adjust volume for detected hands, remaining tracks are muted
+                levels = [min(max(height, 0), 1) for height in snapshot.hand_heights]
+                player.set_volumes(levels, captured_at=snapshot.timestamp)
+                if snapshot.hand_x is not None:
+                    if args.filter:
+                        player.set_filter_positions(snapshot.hand_x)
+                    if args.outputs:
+                        player.set_pan_positions(snapshot.hand_x)
+
+            if time.monotonic() - last_report > REPORT_EVERY:
+                log.info("Frame to audible gain: %s", player.control_latency.summary())
+                log.info("Audio stream:\n%s", player.callback_stats.report())
+                if args.metrics_file:
+                    write_metrics(args.metrics_file, player.metrics())
+                last_report = time.monotonic()
     except KeyboardInterrupt:
-        print("Stopping playback...")
+        log.info("Stopping playback...")
+        log.info("Frame to audible gain: %s", player.control_latency.summary())
+        log.info("Audio stream:\n%s", player.callback_stats.report())
     finally:
         player.stop()
+        if vision is not None:
+            vision.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,94 +1,815 @@
+import math
 import numpy as np
 import sounddevice as sd
 import soundfile as sf
+import logging
 import os
+import sys
+import threading
+from time import monotonic, perf_counter, sleep
+
+from stems import Stem, StemCache, common_sample_rate, load_stems
+from spatial import pan_matrix
+from telemetry import CallbackStats, RingStats, prometheus_summary
+from rtlog import setup_logging
+
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
+
+log = logging.getLogger(__name__)
+
+# frames of scratch space the mixer starts with, grown if a bigger block shows up
+SCRATCH_FRAMES = 1024
+# a gain this close to its target (about -100 dB) counts as settled
+GAIN_EPSILON = 1e-5
+# about how many frames an offline render hands back at once
+RENDER_FRAMES = 8192
+# block sizes tune_blocksize tries, smallest first
+BLOCK_SIZES = (32, 64, 128, 256, 512, 1024, 2048)
+# share of a block's duration the callback may take at p99, the rest is margin for the GIL and the OS
+CALLBACK_BUDGET = 0.25
+# output latency above this is noticeably behind the hands
+TARGET_LATENCY = 0.02
+# filter types set_filter accepts, and the resonance each one uses
+FILTER_Q = {'lowpass': 0.7071, 'bandpass': 2.0}
+# a filter position of 0 puts the cutoff (or band center) here, 1 puts it at FILTER_MAX_HZ, log-spaced in between
+FILTER_MIN_HZ = 100.0
+FILTER_MAX_HZ = 16000.0
+# highest cutoff as a share of the sample rate, a biquad at or past Nyquist blows up
+FILTER_MAX_SHARE = 0.45
+# time constant in seconds for filter cutoffs to follow their position
+FILTER_SMOOTHING = 0.05
+
+# position every track starts at in spatial mode, until set_pan_positions moves it
+PAN_CENTER = 0.5
+
+# what a player keeps when it takes over another player's stems, see _adopt
+PLAYER_STATE = (
+    'stream', 'playing', 'control_latency', 'callback_stats', '_control_stamp',
+    '_swap_lock', '_load_lock', '_incoming', '_retired', '_swap_fade_in', '_swap_fade_out', '_swap_done', '_swap_mix',
+)
 
 class SimultaneousWAVPlayer:
-    def __init__(self, file_list):
+    def __init__(self, file_list, streaming=False, cache=None, workers=None, ramp_time=0.01, sample_rate=None,
+                 crossfade=0.0, loop_lengths=None, outputs=None, pan_law='equal_power'):
         """
         initializes WAV player with all files
         
         :param file_list: list of paths to audio files
+        :param streaming: memory-map WAV files and read them during playback instead of decoding everything into RAM
+        :param cache: optional StemCache so decoded stems are reused across restarts
+        :param workers: number of threads decoding files at once, defaults to one per core
+        :param ramp_time: time constant in seconds for gain changes to glide in, 0 switches instantly
+        :param sample_rate: rate to play at, stems at other rates are resampled while loading.
+                            defaults to the rate most of the files have
+        :param crossfade: seconds of equal-power crossfade from each loop's end into its start, 0 for a hard loop
+        :param loop_lengths: frames after which each stem loops, None entries use the whole stem.
+                             None loops everything together at the end of the shortest stem
+        :param outputs: number of output channels to pan the stems across, every stem is mixed
+                        down to mono for it. None plays the stems in stereo as they are
+        :param pan_law: how a stem is split between neighbouring outputs, one of spatial.PAN_LAWS
         """
         #if not enough input
         if not file_list or len(file_list) < 2:
             raise ValueError("At least two audio files are required")
 
-        self.data = []
         self.sample_rates = []
         self.mute_states = []
         self.volume_levels = []  # New attribute for volume control
 
-        initial_sample_rate = None
-        first_max_length = None
-
-         # read audio files
-        for file in file_list:
-            data, sample_rate = sf.read(file)
-            
-            # plays simultaneously
-            if data.ndim == 1:
-                data = np.column_stack((data, data))
-            
-            # Check sample rate consistency
-            if initial_sample_rate is None:
-                initial_sample_rate = sample_rate
-            elif sample_rate != initial_sample_rate:
-                raise ValueError(f"Mismatched sample rates: {file}")
-            
-            self.data.append(data)
-            self.sample_rates.append(sample_rate)
+        if sample_rate is None:
+            sample_rate = common_sample_rate(file_list)
+         # read audio files, all at once, converting any that differ from sample_rate or have more than 2 channels.
+        # cached copies are kept whole, so adding or removing another stem never invalidates them,
+        # _setup trims to the shortest stem without copying anything
+        loaded, self.load_timings = load_stems(file_list, streaming, cache, None, workers, sample_rate)
+        for stem in loaded:
+            self.sample_rates.append(stem.sample_rate)
             self.mute_states.append(False)
             self.volume_levels.append(1.0)  # Default volume to 1.0 (full volume)
 
-        #all the same length
-        self.max_length = min(len(data) for data in self.data)
-        self.data = [data[:self.max_length] for data in self.data]
+        self._setup(loaded, sample_rate, streaming, ramp_time, crossfade, loop_lengths, outputs, pan_law)
+
+    @classmethod
+    def from_arrays(cls, arrays, sample_rate, ramp_time=0.01, crossfade=0.0, loop_lengths=None, outputs=None,
+                    pan_law='equal_power'):
+        """
+        builds a player from already decoded audio instead of files
+        
+        :param arrays: list of arrays shaped (frames,) or (frames, channels)
+        :param sample_rate: sample rate shared by all the arrays
+        :param ramp_time: see __init__
+        :param crossfade: see __init__
+        :param loop_lengths: see __init__
+        :param outputs: see __init__
+        :param pan_law: see __init__
+        """
+        player = cls.__new__(cls)
+        player.sample_rates = [sample_rate] * len(arrays)
+        player.mute_states = [False] * len(arrays)
+        player.volume_levels = [1.0] * len(arrays)
+        loaded = [
+            Stem(None, np.asarray(data, dtype=np.float32).reshape(len(data), -1), sample_rate)
+            for data in arrays
+        ]
+        player._setup(loaded, sample_rate, ramp_time=ramp_time, crossfade=crossfade, loop_lengths=loop_lengths,
+                      outputs=outputs, pan_law=pan_law)
+        return player
+
+    def _setup(self, loaded, sample_rate, streaming=False, ramp_time=0.01, crossfade=0.0, loop_lengths=None,
+               outputs=None, pan_law='equal_power'):
+        self.n_tracks = len(loaded)
+        if outputs is not None and outputs < 1:
+            raise ValueError("Need at least one output")
+        # stereo stems straight to two outputs, or mono stems panned across any number of them
+        self.outputs = 2 if outputs is None else outputs
+        self.channels = 2 if outputs is None else 1
+        self.pan_law = pan_law
+        if outputs is None:
+            self.pan_positions = None
+            self.pan = None
+        else:
+            self.pan_positions = np.full(self.n_tracks, PAN_CENTER)
+            # (tracks, outputs), only ever replaced as a whole, see set_pan_positions
+            self.pan = pan_matrix(self.pan_positions, outputs, pan_law)
+        frames = [stem.frames for stem in loaded]
+        if loop_lengths is None:
+            #all the same length
+            ends = [min(frames)] * self.n_tracks
+        elif len(loop_lengths) != self.n_tracks:
+            raise ValueError("Need one loop length per stem")
+        else:
+            ends = [total if end is None else min(end, total) for end, total in zip(loop_lengths, frames)]
+
+        # as given, so load_next can hand the same loop settings to the next set
+        self.loop_settings = {'crossfade': crossfade, 'loop_lengths': loop_lengths}
+        self.crossfade_frames = int(round(crossfade * sample_rate))
+        if self.crossfade_frames * 2 > min(ends):
+            raise ValueError("Crossfade must be shorter than half of every loop")
+        # the first pass plays from frame 0, every pass after that starts at the end of the
+        # crossfade, since the loop's start was already heard faded in under its tail
+        self.loop_ends = ends
+        # every track at the same position, so a block is one slice of the bank
+        self._uniform = len(set(ends)) == 1
+        self.max_length = max(ends)
+        self._loop_tails = self._loop_crossfades(loaded, ends)
+
+        if streaming:
+            # tracks stay on disk, each callback reads its block into scratch space
+            self.stems = loaded
+            self.data = None
+        else:
+            # one contiguous (tracks, frames, channels) block so a whole callback is one matmul
+            self.stems = None
+            self.data = np.zeros((self.n_tracks, self.max_length, self.channels), dtype=np.float32)
+            for i, (stem, end) in enumerate(zip(loaded, ends)):
+                # plays simultaneously
+                self._convert(stem, 0, end, self.data[i, :end])
+                if self._loop_tails is not None:
+                    self.data[i, end - self.crossfade_frames:end] = self._loop_tails[i]
+
+        # effective gain per track (volume, or 0 when muted), read by the callback
+        self.gains = np.array(
+            [0 if mute else volume for mute, volume in zip(self.mute_states, self.volume_levels)],
+            dtype=np.float32,
+        )
+        # gain each track actually played at the end of the last block, glides towards its target.
+        # with panning these are (tracks, outputs) matrices, so a move glides like a volume change
+        shape = self.gains.shape if self.pan is None else self.pan.shape
+        self._current_gains = np.empty(shape, dtype=np.float32)
+        self._gain_targets(self._current_gains)
+        self._target_gains = np.empty_like(self._current_gains)
+        self._gain_diff = np.empty_like(self._current_gains)
+        self._gain_error = np.empty_like(self._current_gains)
+
+        self.sample_rate = sample_rate
+        self._capacity = 0
+        self.set_ramp_time(ramp_time)
+
+        # per-track filters, see set_filter. each holds the two state values per channel of a
+        # transposed direct form II biquad, laid out as lfilter's zi: (state, tracks, channels).
+        # coefficients and state are float32 like the samples, so lfilter runs in float32 too
+        self.filter_modes = [None] * self.n_tracks
+        self._filtered_tracks = []
+        self._filter_state = np.zeros((2, self.n_tracks, self.channels), dtype=np.float32)
+        self._filter_q = np.full(self.n_tracks, FILTER_Q['lowpass'])
+        self._bandpass = np.zeros(self.n_tracks, dtype=bool)
+        # log of the cutoff each filter is heading for, and where it's got to
+        self._target_log_cutoff = np.full(self.n_tracks, math.log(self._max_cutoff()))
+        self._log_cutoff = self._target_log_cutoff.copy()
+        self._filter_b = np.zeros((self.n_tracks, 3), dtype=np.float32)
+        self._filter_a = np.zeros((self.n_tracks, 3), dtype=np.float32)
+
+        # camera-frame-to-DAC latency of gain changes, see set_volumes
+        self.control_latency = RingStats()
+        self._control_stamp = None
+        # compute time, headroom, output latency and xruns of every callback
+        self.callback_stats = CallbackStats()
 
         # Playback setup
         self.stream = None
         self.playing = False
         self.pos = 0
-        self.sample_rate = initial_sample_rate
+
+        # stem set switching, see load_next
+        self._swap_lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._incoming = None
+        self._retired = None
+
+    def _loop_crossfades(self, loaded, ends):
+        """
+        precomputes the end of every loop with the loop's start faded in under it
+
+        returns a (tracks, crossfade frames, channels) array that replaces the last
+        frames before each track's loop end, or None without a crossfade
+
+        :param ends: frame each track's material ends at
+        """
+        fade = self.crossfade_frames
+        if not fade:
+            return None
+        # equal power: fade_in ** 2 + fade_out ** 2 == 1 all the way through
+        angle = (np.arange(fade) + 0.5) / fade * (np.pi / 2)
+        fade_in = np.sin(angle).astype(np.float32)[:, None]
+        fade_out = np.cos(angle).astype(np.float32)[:, None]
+        tails = np.empty((len(loaded), fade, self.channels), dtype=np.float32)
+        head = np.empty((fade, self.channels), dtype=np.float32)
+        for i, (stem, end) in enumerate(zip(loaded, ends)):
+            self._convert(stem, end - fade, end, tails[i])
+            self._convert(stem, 0, fade, head)
+            tails[i] *= fade_out
+            head *= fade_in
+            tails[i] += head
+        return tails
+
+    def _loop_position(self, played, end):
+        """
+        where a track is after played frames from the start
+
+        :param end: frame the track's loop ends at, playback then carries on from the end of the crossfade
+        """
+        if played < end:
+            return played
+        fade = self.crossfade_frames
+        return fade + (played - fade) % (end - fade)
+
+    def _convert(self, stem, start, stop, out):
+        """copies frames [start, stop) of a stem into out as float, upmixed to stereo or mixed down to mono"""
+        source = stem.data[start:stop, :2]
+        if self.channels == 2:
+            # converts to float and upmixes mono in one pass, nothing is stored twice
+            np.multiply(source, stem.scale, out=out)
+        else:
+            np.mean(source, axis=1, out=out[:, 0])
+            out *= stem.scale
+
+    def set_ramp_time(self, ramp_time):
+        """
+        changes how fast gain changes glide in
+        
+        :param ramp_time: time constant of the one-pole gain smoother in seconds, 0 switches instantly
+        """
+        self.ramp_time = ramp_time
+        self._allocate(max(self._capacity, SCRATCH_FRAMES))
+
+    def _allocate(self, frames):
+        """(re)allocates every per-block buffer for blocks of up to frames frames"""
+        self._capacity = frames
+        if self.stems is not None or not self._uniform:
+            self._scratch = np.zeros((self.n_tracks, frames, self.channels), dtype=np.float32)
+        self._glide = np.zeros((frames, self.outputs), dtype=np.float32)
+        self._filtered = np.zeros((self.n_tracks, frames, self.channels), dtype=np.float32)
+        if self.ramp_time > 0:
+            # one-pole smoother in closed form: after n samples the remaining distance is pole ** n
+            pole = np.exp(-1 / (self.ramp_time * self.sample_rate))
+            self._decay = (pole ** np.arange(1, frames + 1)).astype(np.float32)
+        else:
+            self._decay = None
+
+    def _read_tracks(self, start, count):
+        """
+        returns frames [start, start + count) of every track as a (tracks, count, channels) float32 array
+
+        :param start: frame to start at, None reads every track from its own loop position
+        """
+        if self.stems is None and self._uniform:
+            return self.data[:, start:start + count]
+
+        block = self._scratch[:, :count]
+        for i in range(self.n_tracks):
+            if self._silent(i):
+                # muted tracks never touch the disk
+                block[i].fill(0)
+            else:
+                position = self._loop_position(self.pos, self.loop_ends[i]) if start is None else start
+                self._read_track(i, position, block[i])
+        return block
+
+    def _read_track(self, index, start, out):
+        """copies len(out) frames of one track into out from start on, wrapping at its loop end"""
+        end = self.loop_ends[index]
+        fade = self.crossfade_frames
+        done = 0
+        while done < len(out):
+            count = min(len(out) - done, end - start)
+            target = out[done:done + count]
+            if self.stems is None:
+                target[:] = self.data[index, start:start + count]
+            else:
+                # the crossfaded loop end comes from memory, the file is left as it is
+                plain = min(count, max(end - fade - start, 0))
+                self._convert(self.stems[index], start, start + plain, target[:plain])
+                if plain < count:
+                    offset = start + plain - (end - fade)
+                    target[plain:] = self._loop_tails[index, offset:offset + count - plain]
+            done += count
+            start = fade
+
+    def _silent(self, index):
+        """True if a track is at 0 gain and staying there, so it doesn't need reading or filtering"""
+        return not self._current_gains[index].any() and not self._target_gains[index].any()
+
+    def _gain_targets(self, out):
+        """writes the gain every track is heading for into out, per output when panning"""
+        # read once, set_pan_positions may publish a new matrix while we mix
+        pan = self.pan
+        if pan is None:
+            np.copyto(out, self.gains)
+        else:
+            np.multiply(self.gains[:, None], pan, out=out)
+
+    def _route(self, gains, tracks, out):
+        """
+        mixes the tracks into out with one matrix multiply
+
+        :param gains: (tracks,) gains, or (tracks, outputs) when panning
+        :param tracks: (tracks, count * channels) samples
+        :param out: contiguous (count, outputs) float32 array
+        """
+        if self.pan is None:
+            # both channels of a track share its gain, so stereo is one long row per track
+            np.matmul(gains, tracks, out=out.reshape(-1))
+        else:
+            np.matmul(tracks.T, gains, out=out)
+
+    def _mix_into(self, out, start, count):
+        """
+        mixes frames [start, start + count) of every track into out
+
+        :param out: contiguous (count, outputs) float32 view of the output buffer
+        """
+        if count > self._capacity:
+            # only happens if the host asks for a bigger block than we've seen so far
+            self._allocate(count)
+
+        # one consistent copy of the targets, set_volume may change them while we mix
+        target = self._target_gains
+        self._gain_targets(target)
+        current = self._current_gains
+        np.subtract(current, target, out=self._gain_diff)
+        decay = self._decay
+        settled = decay is None or np.abs(self._gain_diff, out=self._gain_error).max() < GAIN_EPSILON
+
+        tracks = self._read_tracks(start, count)
+        if self._filtered_tracks:
+            tracks = self._filter_tracks(tracks, count)
+        # (tracks, count, channels) slice flattens to (tracks, count * channels) without copying
+        tracks = tracks.reshape(self.n_tracks, count * self.channels)
+        if settled:
+            current[:] = target
+            self._route(current, tracks, out)
+        else:
+            # the per-sample gain of track t is target[t] + diff[t] * pole ** n, so the mix
+            # splits into the settled mix plus pole ** n times the mix of the differences
+            self._route(target, tracks, out)
+            glide = self._glide[:count]
+            self._route(self._gain_diff, tracks, glide)
+            np.multiply(glide, decay[:count, None], out=glide)
+            np.add(out, glide, out=out)
+            np.multiply(self._gain_diff, decay[count - 1], out=current)
+            np.add(current, target, out=current)
+
+    def _filter_tracks(self, tracks, count):
+        """
+        runs every track that has a filter through it, returns the (tracks, count, channels) block to mix
+
+        cutoffs glide one step per block and the coefficients are recomputed for all
+        tracks at once, the recursion itself runs in C per track. unlike the rest of the
+        mix this allocates: lfilter hands back a new output and state array for every
+        filtered track, and the coefficient math makes a few small temporaries
+        """
+        block = self._filtered[:, :count]
+        np.copyto(block, tracks)
+
+        # the one-pole glide in closed form, so a block split at the loop point moves the same distance
+        step = 1 - math.exp(-count / (FILTER_SMOOTHING * self.sample_rate))
+        distance = self._target_log_cutoff - self._log_cutoff
+        self._log_cutoff += distance * step
+        # snapped once close enough, like the gains, so a settled filter stops changing at all
+        np.copyto(self._log_cutoff, self._target_log_cutoff, where=np.abs(distance) < GAIN_EPSILON)
+        self._update_coefficients()
+
+        for i in self._filtered_tracks:
+            if self._silent(i):
+                # silent either way, the state just waits
+                continue
+            block[i], self._filter_state[:, i] = lfilter(
+                self._filter_b[i], self._filter_a[i], tracks[i], axis=0, zi=self._filter_state[:, i],
+            )
+            if not np.isfinite(self._filter_state[:, i]).all():
+                # shouldn't happen with the cutoff clamped, but a NaN in the state would never leave
+                log.warning("Filter on track %d blew up, resetting it", i)
+                self._filter_state[:, i] = 0
+                block[i].fill(0)
+        return block
+
+    def _max_cutoff(self):
+        """highest cutoff a filter goes to at this sample rate"""
+        return min(FILTER_MAX_HZ, FILTER_MAX_SHARE * self.sample_rate)
+
+    def _update_coefficients(self):
+        """RBJ cookbook low-pass/band-pass biquads for the current cutoffs, normalized so a0 is 1"""
+        w0 = 2 * np.pi * np.minimum(np.exp(self._log_cutoff) / self.sample_rate, FILTER_MAX_SHARE)
+        cos = np.cos(w0)
+        alpha = np.sin(w0) / (2 * self._filter_q)
+        scale = 1 / (1 + alpha)
+        lowpass = (1 - cos) / 2 * scale
+        self._filter_b[:, 0] = np.where(self._bandpass, alpha * scale, lowpass)
+        self._filter_b[:, 1] = np.where(self._bandpass, 0, 2 * lowpass)
+        self._filter_b[:, 2] = np.where(self._bandpass, -alpha * scale, lowpass)
+        self._filter_a[:, 0] = 1
+        self._filter_a[:, 1] = -2 * cos * scale
+        self._filter_a[:, 2] = (1 - alpha) * scale
+
+    def set_filter(self, index, mode):
+        """
+        puts a filter on one track, its cutoff then follows set_filter_positions
+        
+        :param index: track index
+        :param mode: 'lowpass', 'bandpass' or None to take the filter off
+        """
+        if mode is not None and mode not in FILTER_Q:
+            raise ValueError(f"Unknown filter {mode!r}, expected one of {', '.join(FILTER_Q)}")
+        if mode is not None and lfilter is None:
+            raise ValueError("Filters need scipy")
+        if not 0 <= index < self.n_tracks:
+            log.warning("Invalid file index: %d", index)
+            return
+        if mode is not None:
+            self._filter_q[index] = FILTER_Q[mode]
+            self._bandpass[index] = mode == 'bandpass'
+        if (mode is None) != (self.filter_modes[index] is None):
+            # a filter that comes back starts from silence instead of wherever it stopped
+            self._filter_state[:, index] = 0
+        self.filter_modes[index] = mode
+        # swapped as a whole, the callback only ever sees a complete list
+        self._filtered_tracks = [i for i, track_mode in enumerate(self.filter_modes) if track_mode is not None]
+
+    def set_filter_positions(self, positions):
+        """
+        moves every track's filter cutoff, log-spaced between FILTER_MIN_HZ (0) and _max_cutoff() (1)
+        
+        :param positions: position per track between 0 and 1, NaN leaves that track's
+                          filter where it is, tracks past the end of the list are left alone
+        """
+        count = min(len(positions), self.n_tracks)
+        positions = np.clip(np.asarray(positions[:count], dtype=float), 0, 1)
+        known = ~np.isnan(positions)
+        high = self._max_cutoff()
+        log_cutoff = math.log(FILTER_MIN_HZ) + positions * (math.log(high) - math.log(FILTER_MIN_HZ))
+        self._target_log_cutoff[:count][known] = log_cutoff[known]
+
+    def set_pan_positions(self, positions):
+        """
+        moves every track across the outputs, 0 puts it on the first output and 1 on the last
+
+        the new matrix is built here and published by swapping one reference, the
+        callback never waits for it and glides to it like a volume change
+        
+        :param positions: position per track between 0 and 1, NaN leaves that track where it is,
+                          tracks past the end of the list are left alone
+        """
+        if self.pan is None:
+            raise ValueError("Panning needs a player made with outputs")
+        # the stem set can't be switched halfway through, the callback only ever tries this lock
+        with self._swap_lock:
+            incoming = self._incoming
+            if incoming is not None:
+                incoming.set_pan_positions(positions)
+            count = min(len(positions), self.n_tracks)
+            positions = np.clip(np.asarray(positions[:count], dtype=float), 0, 1)
+            known = ~np.isnan(positions)
+            self.pan_positions[:count][known] = positions[known]
+            self.pan = pan_matrix(self.pan_positions, self.outputs, self.pan_law)
 
     def _audio_callback(self, output, frames, time, status):
+        start = perf_counter()
         if status:
-            print(status)
+            log.warning("stream status: %s", status)
 
-        end = self.pos + frames
+        incoming = self._incoming
+        if incoming is None:
+            self._fill(output, frames)
+        else:
+            self._switch_block(incoming, output, frames)
 
-        #slicing into chunks
-        chunks = [
-            data[self.pos:end] * (0 if mute else volume)
-            for data, mute, volume in zip(self.data, self.mute_states, self.volume_levels)
-        ]
+        # the newest gain change is audible once this block reaches the DAC
+        stamp = self._control_stamp
+        if stamp is not None:
+            self._control_stamp = None
+            latency = monotonic() - stamp
+            if time is not None:
+                latency += time.outputBufferDacTime - time.currentTime
+            self.control_latency.add(latency)
 
-        # combine chunks
-        mixed_chunk = np.sum(chunks, axis=0)
-        
-        output[: len(mixed_chunk)] = mixed_chunk
-        if len(mixed_chunk) < len(output):
-            output[len(mixed_chunk) :] = 0
+        self.callback_stats.record(perf_counter() - start, frames / self.sample_rate, time, status)
+
+    def _fill(self, output, frames):
+        """mixes the next frames frames into output and moves the play position on"""
+        if not self._uniform:
+            # every track wraps at its own loop end while it's read, pos just counts frames played
+            self._mix_into(output, None, frames)
+            self.pos += frames
+            return
 
-        self.pos = end
+        pos = self.pos
+
+        # play up to the loop point, then keep filling from the loop start
+        fade = self.crossfade_frames
+        written = min(frames, self.max_length - pos)
+        self._mix_into(output[:written], pos, written)
+        while written < frames:
+            count = min(frames - written, self.max_length - fade)
+            self._mix_into(output[written:written + count], fade, count)
+            written += count
 
         # looping if reached the end!!
-        if end >= self.max_length:
-            self.pos = 0
-            end = frames
+        self.pos = self._loop_position(pos + frames, self.max_length)
+
+    def _switch_block(self, incoming, output, frames):
+        """plays one block of the crossfade to incoming, taking over its stems once it's done"""
+        fade = len(self._swap_fade_in)
+        done = self._swap_done
+        fading = min(frames, fade - done)
+
+        if frames > len(self._swap_mix):
+            self._swap_mix = np.zeros((frames, self.outputs), dtype=np.float32)
+        mix = self._swap_mix[:frames]
+        incoming._fill(mix, frames)
+        if fading > 0:
+            self._fill(output, frames)
+            np.multiply(output[:fading], self._swap_fade_out[done:done + fading, None], out=output[:fading])
+            np.multiply(mix[:fading], self._swap_fade_in[done:done + fading, None], out=mix[:fading])
+            np.add(output[:fading], mix[:fading], out=output[:fading])
+            self._swap_done = done + fading
+        output[max(fading, 0):] = mix[max(fading, 0):]
+
+        # a volume change holds the lock for microseconds, if it's busy we just try again next block
+        if self._swap_done >= fade and self._swap_lock.acquire(blocking=False):
+            try:
+                self._adopt(incoming)
+            finally:
+                self._swap_lock.release()
+
+    def _adopt(self, incoming):
+        """takes over every stem and mixing attribute of incoming, keeping the stream and the stats"""
+        state = vars(self)
+        # the old stems are freed by the loader thread, freeing them here could stall the callback
+        self._retired = {key: value for key, value in state.items() if key not in PLAYER_STATE}
+        state.update((key, value) for key, value in vars(incoming).items() if key not in PLAYER_STATE)
+        self._incoming = None
+
+    def load_next(self, file_list, swap_crossfade=1.0, streaming=False, cache=None, workers=None, **settings):
+        """
+        loads another set of stems on a background thread, then switches to it
+        without stopping the stream
+        
+        the switch happens at a block boundary, with an equal-power crossfade
+        from the old set to the new one (which starts from its beginning).
+        current volumes, filters, pan positions and loop settings carry over by track index
+        
+        :param file_list: see __init__
+        :param swap_crossfade: seconds the old and new set overlap, 0 switches at the next block
+        :param streaming: see __init__
+        :param cache: see __init__
+        :param workers: see __init__
+        :param settings: other keyword arguments for __init__. crossfade and loop_lengths default to
+                         ours (loop lengths past our track count loop the whole stem), the sample
+                         rate and outputs are always ours
+        :return: the loader thread
+        """
+        thread = threading.Thread(
+            target=self._load_next, args=(file_list, swap_crossfade, streaming, cache, workers, settings),
+            name='stem-loader', daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def _load_next(self, file_list, swap_crossfade, streaming, cache, workers, settings):
+        with self._load_lock:
+            start = perf_counter()
+            try:
+                settings.setdefault('crossfade', self.loop_settings['crossfade'])
+                loop_lengths = self.loop_settings['loop_lengths']
+                if loop_lengths is not None:
+                    loop_lengths = (list(loop_lengths) + [None] * len(file_list))[:len(file_list)]
+                settings.setdefault('loop_lengths', loop_lengths)
+                settings.update(outputs=None if self.pan is None else self.outputs, pan_law=self.pan_law)
+                incoming = SimultaneousWAVPlayer(
+                    file_list, streaming, cache, workers, self.ramp_time, self.sample_rate, **settings,
+                )
+            except Exception:
+                # whatever went wrong, the loader thread logs it instead of dying with a bare traceback
+                log.exception("Couldn't load the new stems, keeping the current ones")
+                return
+            log.info("Loaded %d new stems in %.2f s", incoming.n_tracks, perf_counter() - start)
 
-    def play(self):
-        """Start playing audio files simultaneously"""
+            fade = int(round(swap_crossfade * self.sample_rate))
+            angle = (np.arange(fade) + 0.5) / max(fade, 1) * (np.pi / 2)
+            for index, mode in enumerate(self.filter_modes[:incoming.n_tracks]):
+                incoming.set_filter(index, mode)
+            shared = min(self.n_tracks, incoming.n_tracks)
+            incoming._target_log_cutoff[:shared] = self._target_log_cutoff[:shared]
+            incoming._log_cutoff[:shared] = self._log_cutoff[:shared]
+            with self._swap_lock:
+                incoming.set_volumes(self.volume_levels)
+                if self.pan is not None:
+                    incoming.set_pan_positions(self.pan_positions)
+                incoming._gain_targets(incoming._current_gains)
+                # sized for the blocks we're already getting, so the callback doesn't allocate
+                incoming._allocate(self._capacity)
+                self._swap_fade_in = np.sin(angle).astype(np.float32)
+                self._swap_fade_out = np.cos(angle).astype(np.float32)
+                self._swap_done = 0
+                self._swap_mix = np.zeros((self._capacity, self.outputs), dtype=np.float32)
+                self._retired = None
+                if not self.playing:
+                    self._adopt(incoming)
+                else:
+                    self._incoming = incoming
+
+            while self._incoming is incoming:
+                sleep(0.01)
+            self._retired = None
+            log.info("Switched to the new stems")
+
+    def render_blocks(self, duration, automation=(), blocksize=512, render_frames=RENDER_FRAMES):
+        """
+        mixes duration seconds from the start without a stream, yielding (frames, outputs) float32 blocks
+        
+        the result is bit-identical to what the callback mixes with this blocksize
+        while set_volumes is called at every automation time. a change lands on the
+        first block boundary at or after its time. everything is mixed one stream block
+        at a time, exactly as the callback would, since BLAS may round a wider mix
+        differently, see check_render.py
+        
+        :param duration: seconds to render
+        :param automation: (seconds, levels) pairs in time order, levels as for set_volumes
+        :param blocksize: frames per callback of the stream being reproduced
+        :param render_frames: about how many frames are yielded at once, the yielded array is reused for the next
+        """
+        if self.playing:
+            raise RuntimeError("Can't render while the stream is playing")
+        total = int(round(duration * self.sample_rate))
+        # a whole number of stream blocks, so blocks never straddle two yields
+        chunk = max(render_frames // blocksize, 1) * blocksize
+        output = np.zeros((chunk, self.outputs), dtype=np.float32)
+
+        events = iter(automation)
+        event = next(events, None)
+        # starts the way play() does
+        self.pos = 0
+        self._gain_targets(self._current_gains)
+        done = 0
+        while done < total:
+            count = min(chunk, total - done)
+            for start in range(0, count, blocksize):
+                # applied before the first block that starts at or after it, like the callback would see it
+                while event is not None and int(round(event[0] * self.sample_rate)) <= done + start:
+                    self.set_volumes(event[1])
+                    event = next(events, None)
+                frames = min(blocksize, count - start)
+                self._fill(output[start:start + frames], frames)
+            yield output[:count]
+            done += count
+
+    def render(self, path, duration, automation=(), blocksize=512, subtype='FLOAT'):
+        """
+        mixes duration seconds into an audio file, many times faster than real time
+        
+        :param path: file to write, the format comes from its extension
+        :param duration: seconds to render
+        :param automation: see render_blocks
+        :param blocksize: see render_blocks
+        :param subtype: soundfile subtype, the default FLOAT keeps the samples exactly as mixed
+        """
+        start = perf_counter()
+        with sf.SoundFile(path, 'w', self.sample_rate, self.outputs, subtype=subtype) as f:
+            for block in self.render_blocks(duration, automation, blocksize):
+                f.write(block)
+        elapsed = perf_counter() - start
+        log.info("Rendered %.1f s to %s in %.2f s (%.0fx real time)",
+                 duration, path, elapsed, duration / max(elapsed, 1e-9))
+
+    def metrics(self):
+        """callback and control latency stats as Prometheus text, see telemetry.serve_metrics"""
+        lines = prometheus_summary("mus277_control_latency_seconds", self.control_latency,
+                                   "time from camera frame to the gain change reaching the DAC")
+        return self.callback_stats.prometheus() + '\n'.join(lines) + '\n'
+
+    def tune_blocksize(self, budget=CALLBACK_BUDGET, block_sizes=BLOCK_SIZES, iterations=200):
+        """
+        times the callback at each block size with the current tracks and returns the
+        smallest block size whose p99 cost stays within budget of the block's duration
+        
+        every track is measured unmuted and mid-glide, the most expensive path, through
+        the whole callback with its own timing and stats. blocks are also kept at least
+        one GIL switch interval long, since that's how long the callback can wait for
+        another Python thread before it even starts. the play position, gains, filter
+        state and callback stats are all put back afterwards
+        
+        :param budget: share of the block duration the callback may use
+        :param block_sizes: candidates, the largest is returned if none fits
+        :param iterations: callbacks timed per block size
+        """
+        if self.playing:
+            raise RuntimeError("Can't tune the block size while the stream is playing")
+        saved_gains = self.gains.copy()
+        saved_pos = self.pos
+        # noise run through the filters would otherwise ring out at the start of the show
+        saved_filter_state = self._filter_state.copy()
+        saved_log_cutoff = self._log_cutoff.copy()
+        saved_stats = self.callback_stats
+        saved_stamp = self._control_stamp
+        self.callback_stats = CallbackStats()
+        self._control_stamp = None
+        self.gains.fill(1)
+
+        chosen = max(block_sizes)
+        for blocksize in sorted(block_sizes):
+            output = np.zeros((blocksize, self.outputs), dtype=np.float32)
+            times = np.empty(iterations)
+            for i in range(iterations):
+                self._current_gains.fill(0)
+                start = perf_counter()
+                self._audio_callback(output, blocksize, None, None)
+                times[i] = perf_counter() - start
+            cost = np.percentile(times, 99)
+            duration = blocksize / self.sample_rate
+            log.debug("Block size %d: p99 callback %.1f us of %.1f us", blocksize, cost * 1e6, duration * 1e6)
+            if cost <= budget * duration and duration >= sys.getswitchinterval():
+                chosen = blocksize
+                break
+
+        self.gains[:] = saved_gains
+        self._gain_targets(self._current_gains)
+        self.pos = saved_pos
+        self._filter_state[:] = saved_filter_state
+        self._log_cutoff[:] = saved_log_cutoff
+        self.callback_stats = saved_stats
+        self._control_stamp = saved_stamp
+        log.info("Tuned block size for %d tracks: %d frames (%.1f ms)",
+                 self.n_tracks, chosen, chosen / self.sample_rate * 1000)
+        return chosen
+
+    def play(self, blocksize=0, latency=None, device=None, auto_tune=False):
+        """
+        Start playing audio files simultaneously
+        
+        :param blocksize: frames per callback, 0 lets PortAudio pick (and vary) it
+        :param latency: output latency in seconds, or 'low' / 'high', None for the device default
+        :param device: output device index or name substring, None for the default device
+        :param auto_tune: pick blocksize with tune_blocksize instead
+        """
         if not self.playing:
+            if auto_tune:
+                blocksize = self.tune_blocksize()
             self.pos = 0 #position of the audio during playback
+            # nothing is playing yet, so there is nothing to glide from
+            self._gain_targets(self._current_gains)
             self.playing = True
             self.stream = sd.OutputStream(
                 samplerate=self.sample_rate, 
-                channels=2, 
+                blocksize=blocksize,
+                device=device,
+                channels=self.outputs, 
+                # what we mix in, so PortAudio doesn't convert every block
+                dtype='float32',
+                latency=latency,
                 callback=self._audio_callback
             )
             self.stream.start()
 
+            stream_latency = getattr(self.stream, 'latency', None)
+            if stream_latency is not None:
+                log.info("Output latency %.1f ms, block size %s", stream_latency * 1000, blocksize or "variable")
+                if stream_latency > TARGET_LATENCY:
+                    log.warning("Output latency is over %.0f ms, try latency='low' or a smaller block size",
+                                TARGET_LATENCY * 1000)
+
     def stop(self):
         """stops playback"""
         if self.stream:
@@ -103,11 +824,40 @@ class SimultaneousWAVPlayer:
         
         :param index: index of the audio file to mute/unmute -- this is 0 indexed
         """
-        if 0 <= index < len(self.mute_states):
-            self.mute_states[index] = not self.mute_states[index]
-            print(f"File {index + 1} muted: {self.mute_states[index]}")
-        else:
-            print(f"Invalid file index: {index}")
+        with self._swap_lock:
+            if 0 <= index < len(self.mute_states):
+                self.mute_states[index] = not self.mute_states[index]
+                self._update_gain(index)
+                log.info("File %d muted: %s", index + 1, self.mute_states[index])
+            else:
+                log.warning("Invalid file index: %d", index)
+
+    def set_volumes(self, levels, captured_at=None):
+        """
+        sets the volume of every track at once, only touching tracks whose volume changed
+        
+        :param levels: volume per track, tracks past the end of the list are set to 0
+        :param captured_at: time.monotonic() of the camera frame behind levels, used to measure control latency
+        :return: True if any volume changed
+        """
+        # the stem set can't be switched halfway through
+        with self._swap_lock:
+            incoming = self._incoming
+            if incoming is not None:
+                # the set we're fading to follows the hands too
+                incoming.set_volumes(levels)
+            changed = False
+            for index in range(self.n_tracks):
+                volume = levels[index] if index < len(levels) else 0
+                if volume != self.volume_levels[index]:
+                    self.set_volume(index, volume)
+                    changed = True
+        if changed and captured_at is not None:
+            self._control_stamp = captured_at
+        return changed
+
+    def _update_gain(self, index):
+        self.gains[index] = 0 if self.mute_states[index] else self.volume_levels[index]
 
     def set_volume(self, index, volume):
         """
@@ -116,16 +866,19 @@ class SimultaneousWAVPlayer:
         :param index: index of the audio file to adjust volume
         :param volume: volume level between 0.0 and 1.0
         """
-        if 0 <= index < len(self.volume_levels):
-            if 0 <= volume <= 1:
-                self.volume_levels[index] = volume
-                print(f"File {index + 1} volume set to: {volume}")
+        with self._swap_lock:
+            if 0 <= index < len(self.volume_levels):
+                if 0 <= volume <= 1:
+                    self.volume_levels[index] = volume
+                    self._update_gain(index)
+                    log.debug("File %d volume set to: %s", index + 1, volume)
+                else:
+                    log.warning("Volume must be between 0 and 1")
             else:
-                print("Volume must be between 0 and 1")
-        else:
-            print(f"Invalid file index: {index}")
+                log.warning("Invalid file index: %d", index)
 
 def main():
+    setup_logging()
     keyword = "SOUND ART"
     wav_files = [f for f in os.listdir('.') if f.endswith('.wav') and keyword in f]
     
@@ -137,7 +890,9 @@ def main():
     for i, file in enumerate(wav_files, 1):
         print(f"{i}. {file}")
     try:
-        player = SimultaneousWAVPlayer(wav_files)
+        cache = StemCache()
+        player = SimultaneousWAVPlayer(wav_files, cache=cache)
+        print(cache.report())
         player.play()
 
         while True:
@@ -0,0 +1,102 @@
+import cv2
+import numpy as np
+import threading
+import time
+
+from poses import LEFT_WRIST, MIN_CONFIDENCE, RIGHT_WRIST, empty_poses
+
+
+def draw_overlay(frame, poses, hand_heights):
+    """
+    draws keypoints, hand markers and the hand height bar graph onto frame in place
+
+    :param frame: BGR image the people were tracked in
+    :param poses: (N, 17, 3) array from controller.extract_keypoints
+    :param hand_heights: list of hand heights [L0, R0, L1, R1, ...]
+    """
+    frame_height, frame_width = frame.shape[:2]
+    pixels = (poses[..., :2] * (frame_width, frame_height)).astype(int)
+    found = poses[..., 2] >= MIN_CONFIDENCE
+
+    for person, person_found in zip(pixels, found):
+        for i in np.flatnonzero(person_found):
+            x_px, y_px = person[i]
+            
+            # Draw each keypoint with a circle
+            cv2.circle(frame, (x_px, y_px), 5, (0, 255, 255), -1)
+            
+            # Label each keypoint
+            cv2.putText(frame, f"kp_{i}", (x_px + 5, y_px - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+    
+    # Draw hand positions specifically (left hand: blue, right hand: red)
+    for person, person_found in zip(pixels, found):
+        if person_found[LEFT_WRIST]:
+            cv2.circle(frame, tuple(person[LEFT_WRIST]), 10, (255, 0, 0), -1)
+        if person_found[RIGHT_WRIST]:
+            cv2.circle(frame, tuple(person[RIGHT_WRIST]), 10, (0, 0, 255), -1)
+
+    # Draw bar graph for hand heights
+    bar_height = 100
+    bar_width = 30
+    gap = 10
+    start_x = 10
+    start_y = frame.shape[0] - 110
+
+    for i, height in enumerate(hand_heights):
+        bar_top = int(start_y + bar_height * (1 - height))
+
+        cv2.rectangle(frame, (start_x, start_y), (start_x + bar_width, bar_top), (0, 255, 0), -1)
+        cv2.rectangle(frame, (start_x, start_y), (start_x + bar_width, start_y + bar_height), (255, 255, 0), 2)
+
+        label = f"Ch {i+1}"
+        cv2.putText(frame, label, (start_x, start_y + bar_height + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        
+        value = f"{height:.2f}"
+        cv2.putText(frame, value, (start_x, bar_top - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        
+        start_x += bar_width + gap
+
+    return frame
+
+
+class PreviewRenderer(threading.Thread):
+    """
+    shows the tracking preview window on its own thread at a fixed, lower rate
+
+    it only ever reads the newest snapshot, so a slow window never holds up tracking.
+    pressing q in the window sets quit_requested
+    """
+    def __init__(self, snapshots, fps=10, window_name='Hand Tracking'):
+        """
+        :param snapshots: LatestSnapshot published by the tracker
+        :param fps: preview frames per second
+        :param window_name: title of the preview window
+        """
+        super().__init__(daemon=True)
+        self.snapshots = snapshots
+        self.interval = 1 / fps
+        self.window_name = window_name
+        self.quit_requested = threading.Event()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        seq = 0
+        next_frame = time.monotonic()
+        while not self._stop_event.is_set():
+            snapshot = self.snapshots.latest()
+            if snapshot is not None and snapshot.seq != seq and snapshot.frame is not None:
+                seq = snapshot.seq
+                # the tracker may still be using the frame, draw on a copy
+                poses = snapshot.poses if snapshot.poses is not None else empty_poses()
+                frame = draw_overlay(snapshot.frame.copy(), poses, snapshot.hand_heights)
+                cv2.imshow(self.window_name, frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                self.quit_requested.set()
+                break
+
+            next_frame += self.interval
+            time.sleep(max(0, next_frame - time.monotonic()))
+        cv2.destroyWindow(self.window_name)
@@ -0,0 +1,127 @@
+import numpy as np
+
+from poses import MIN_CONFIDENCE
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+
+def bounding_boxes(poses):
+    """
+    returns an (N, 4) array of (x0, y0, x1, y1) around each person's confident keypoints
+
+    :param poses: (N, 17, 3) array, see poses.py
+    """
+    points = poses[..., :2]
+    confident = poses[..., 2] >= MIN_CONFIDENCE
+    # people with no confident keypoint get a box around all of them
+    confident[~confident.any(axis=1)] = True
+    low = np.where(confident[..., None], points, np.inf).min(axis=1)
+    high = np.where(confident[..., None], points, -np.inf).max(axis=1)
+    return np.concatenate([low, high], axis=1)
+
+
+def iou_matrix(a, b):
+    """
+    intersection over union of every box in a with every box in b
+
+    :param a: (N, 4) boxes
+    :param b: (M, 4) boxes
+    :return: (N, M) array
+    """
+    low = np.maximum(a[:, None, :2], b[None, :, :2])
+    high = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.clip(high - low, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-9)
+
+
+def assign(cost):
+    """
+    minimum-cost one-to-one assignment between the rows and columns of cost
+
+    uses the Hungarian algorithm from scipy when it's installed, otherwise
+    takes the cheapest remaining pair greedily
+
+    :return: (row indices, column indices)
+    """
+    if linear_sum_assignment is not None:
+        return linear_sum_assignment(cost)
+    rows, cols = [], []
+    for flat in np.argsort(cost, axis=None):
+        i, j = np.unravel_index(flat, cost.shape)
+        if i not in rows and j not in cols:
+            rows.append(int(i))
+            cols.append(int(j))
+    return np.array(rows, dtype=int), np.array(cols, dtype=int)
+
+
+class SlotTracker:
+    """
+    gives every person a stable slot, so their two stems stay with them even
+    when the detector lists people in a different order
+
+    slot s drives stems 2s (left hand) and 2s + 1 (right hand). people are
+    matched to slots by bounding box overlap with where the slot's person was
+    last seen. a slot whose person hasn't been seen for timeout seconds is freed
+    for the next new person. everything is kept in (max_slots,) arrays
+    """
+    def __init__(self, max_slots, iou_threshold=0.2, timeout=2.0):
+        """
+        :param max_slots: most people tracked at once, people beyond that don't get stems
+        :param iou_threshold: least box overlap for a person to count as the same as a slot's
+        :param timeout: seconds a slot is kept for a person that disappeared
+        """
+        self.max_slots = max_slots
+        self.iou_threshold = iou_threshold
+        self.timeout = timeout
+        self.boxes = np.zeros((max_slots, 4))
+        self.last_seen = np.full(max_slots, -np.inf)
+
+    def update(self, poses, now):
+        """
+        matches the people in a frame to slots
+
+        :param poses: (N, 17, 3) array, see poses.py
+        :param now: time.monotonic() of the frame
+        :return: (N,) int array with each person's slot, -1 for people without one
+        """
+        slots = np.full(len(poses), -1, dtype=int)
+        if not len(poses):
+            return slots
+        boxes = bounding_boxes(poses)
+
+        active = np.flatnonzero(now - self.last_seen <= self.timeout)
+        if len(active):
+            overlap = iou_matrix(boxes, self.boxes[active])
+            rows, cols = assign(1 - overlap)
+            keep = overlap[rows, cols] >= self.iou_threshold
+            slots[rows[keep]] = active[cols[keep]]
+
+        # newcomers take the lowest free slots
+        free = np.setdiff1d(np.arange(self.max_slots), np.concatenate([active, slots[slots >= 0]]))
+        newcomers = np.flatnonzero(slots < 0)[:len(free)]
+        slots[newcomers] = free[:len(newcomers)]
+
+        tracked = slots >= 0
+        self.boxes[slots[tracked]] = boxes[tracked]
+        self.last_seen[slots[tracked]] = now
+        return slots
+
+    def arrange(self, per_person, slots, empty=0.0):
+        """
+        reorders per-person hand values [L0, R0, L1, R1, ...] into slot order
+
+        :param per_person: (2N,) array, e.g. from controller.get_hand_heights
+        :param slots: (N,) array from update
+        :param empty: value for slots nobody is in
+        :return: (2 * max_slots,) array
+        """
+        arranged = np.full((self.max_slots, 2), empty, dtype=np.float32)
+        tracked = slots >= 0
+        arranged[slots[tracked]] = np.reshape(per_person, (-1, 2))[tracked]
+        return arranged.reshape(-1)
@@ -0,0 +1,133 @@
+import collections
+import logging
+import threading
+import time
+
+from telemetry import RingStats
+
+log = logging.getLogger(__name__)
+
+
+class DropOldestQueue:
+    """
+    bounded queue where put doesn't block, a full queue throws away its oldest item instead
+
+    :param maxsize: items held at most
+    """
+    def __init__(self, maxsize=1):
+        self._items = collections.deque(maxlen=maxsize)
+        self._ready = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item, block=False):
+        """
+        :param item: anything but None
+        :param block: wait for space instead of dropping, for offline runs that must see every item
+        """
+        with self._ready:
+            if block:
+                self._ready.wait_for(lambda: len(self._items) < self._items.maxlen or self._closed)
+            if len(self._items) == self._items.maxlen:
+                # the deque pushes the oldest item out by itself
+                self.dropped += 1
+            self._items.append(item)
+            self._ready.notify_all()
+
+    def get(self):
+        """blocks for the next item, returns None once the queue is closed and empty"""
+        with self._ready:
+            self._ready.wait_for(lambda: self._items or self._closed)
+            item = self._items.popleft() if self._items else None
+            # wakes a put(block=True) waiting for space
+            self._ready.notify_all()
+            return item
+
+    def close(self):
+        with self._ready:
+            self._closed = True
+            self._ready.notify_all()
+
+
+class Pipeline:
+    """
+    runs each stage on its own thread, linked by DropOldestQueues
+
+    the first stage is called with no arguments and produces items, returning None
+    when it runs dry. every later stage gets the previous stage's item and returns
+    the item for the next one (or None to drop it). a slow stage makes the stages
+    in front of it drop old items instead of building a backlog
+
+    :param stages: list of (name, function)
+    :param queue_size: items buffered between two stages
+    :param lossless: make stages wait for the next one instead of dropping, for benchmarks
+    """
+    def __init__(self, stages, queue_size=1, lossless=False):
+        self.stages = stages
+        self.lossless = lossless
+        self.timings = {name: RingStats() for name, _ in stages}
+        self.queues = [DropOldestQueue(queue_size) for _ in stages[1:]]
+        self._stop_event = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run_stage, args=(i,), name=f"pipeline-{name}", daemon=True)
+            for i, (name, _) in enumerate(stages)
+        ]
+
+    def _run_stage(self, index):
+        name, function = self.stages[index]
+        inbox = self.queues[index - 1] if index > 0 else None
+        outbox = self.queues[index] if index < len(self.queues) else None
+        timings = self.timings[name]
+        try:
+            while not self._stop_event.is_set():
+                if inbox is None:
+                    start = time.perf_counter()
+                    item = function()
+                    if item is None:
+                        break
+                else:
+                    item = inbox.get()
+                    if item is None:
+                        break
+                    start = time.perf_counter()
+                    item = function(item)
+                timings.add(time.perf_counter() - start)
+                if item is not None and outbox is not None:
+                    outbox.put(item, block=self.lossless)
+        except Exception:
+            log.exception("Pipeline stage %s failed", name)
+            self.stop()
+        finally:
+            # whatever is still queued downstream gets finished, then those stages end too
+            if outbox is not None:
+                outbox.close()
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """stops every stage, items still queued are dropped"""
+        self._stop_event.set()
+        for q in self.queues:
+            q.close()
+
+    def join(self, timeout=None):
+        """waits for the last stage to finish, returns True if it did"""
+        self._threads[-1].join(timeout)
+        return not self._threads[-1].is_alive()
+
+    def dropped(self):
+        """{stage name: items thrown away in front of it because it was busy}"""
+        return {name: q.dropped for (name, _), q in zip(self.stages[1:], self.queues)}
+
+    def report(self):
+        """one line per stage with its timing percentiles and drop count"""
+        dropped = self.dropped()
+        lines = []
+        for name, _ in self.stages:
+            line = f"{name}: {self.timings[name].summary()}"
+            if name in dropped:
+                line += f", {dropped[name]} dropped"
+            lines.append(line)
+        return '\n'.join(lines)
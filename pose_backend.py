@@ -0,0 +1,127 @@
+import glob
+import logging
+import os
+import shutil
+
+import numpy as np
+from ultralytics import YOLO
+
+log = logging.getLogger(__name__)
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+DEFAULT_WEIGHTS = 'yolo11n-pose.pt'
+
+
+def export_path(weights, backend, imgsz):
+    """
+    where the exported model for these settings is cached, next to the weights
+
+    :param weights: path to the .pt weights
+    :param backend: 'onnx' or 'openvino'
+    :param imgsz: input resolution the model was exported for
+    """
+    stem = os.path.splitext(weights)[0]
+    if backend == 'onnx':
+        return f"{stem}_{imgsz}.onnx"
+    # ultralytics recognizes OpenVINO models by this directory suffix
+    return f"{stem}_{imgsz}_openvino_model"
+
+
+def export_model(weights, backend, imgsz):
+    """
+    exports the weights for a CPU runtime, reusing an earlier export if it's still current
+
+    :return: path of the exported model
+    """
+    target = export_path(weights, backend, imgsz)
+    if os.path.exists(target) and (
+        not os.path.exists(weights) or os.path.getmtime(target) >= os.path.getmtime(weights)
+    ):
+        return target
+
+    log.info("Exporting %s to %s at %d px, this only happens once", weights, backend, imgsz)
+    exported = YOLO(weights).export(format=backend, imgsz=imgsz)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    elif os.path.exists(target):
+        os.remove(target)
+    os.replace(exported, target)
+    return target
+
+
+class PoseModel:
+    """
+    pose model that can run on PyTorch, ONNX Runtime or OpenVINO
+
+    called like the YOLO object it wraps: results = pose_model(frame)
+    """
+    def __init__(self, weights=DEFAULT_WEIGHTS, backend='torch', imgsz=640, threads=None):
+        """
+        :param weights: path to the .pt weights, downloaded by ultralytics if missing
+        :param backend: one of BACKENDS
+        :param imgsz: input resolution, smaller is faster but finds fewer small/far people
+        :param threads: CPU threads for inference, None leaves the runtime's default
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+        self.backend = backend
+        self.imgsz = imgsz
+        self.threads = threads
+
+        if threads:
+            # torch also does the pre/post-processing for the exported backends
+            import torch
+            torch.set_num_threads(threads)
+
+        self.path = weights if backend == 'torch' else export_model(weights, backend, imgsz)
+        self.model = YOLO(self.path, task='pose')
+        # the exported runtimes only exist after the first call, see _limit_threads
+        self._threads_limited = backend == 'torch' or not threads
+
+    def warmup(self, frame_shape=(480, 640, 3), runs=2):
+        """
+        runs a blank frame through the model so the first real frame doesn't pay
+        for lazy initialization, allocator growth and the thread limit setup
+
+        :param frame_shape: shape of the frames the camera will deliver
+        :param runs: how many times to run it
+        """
+        frame = np.zeros(frame_shape, dtype=np.uint8)
+        for _ in range(runs):
+            self(frame)
+
+    def __call__(self, frame, imgsz=None):
+        """
+        :param frame: BGR image
+        :param imgsz: inference resolution for this call, only the torch backend can change it
+        """
+        if imgsz is None or self.backend != 'torch':
+            # exported models have their input size baked in
+            imgsz = self.imgsz
+        results = self.model(frame, imgsz=imgsz, verbose=False)
+        if not self._threads_limited:
+            self._threads_limited = True
+            self._limit_threads()
+        return results
+
+    def _limit_threads(self):
+        """rebuilds the ONNX Runtime session / OpenVINO model ultralytics created with a thread limit"""
+        predictor = getattr(self.model, 'predictor', None)
+        runtime = getattr(predictor, 'model', None)
+        if self.backend == 'onnx' and hasattr(runtime, 'session'):
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+            runtime.session = onnxruntime.InferenceSession(
+                self.path, options, providers=['CPUExecutionProvider'],
+            )
+        elif self.backend == 'openvino' and hasattr(runtime, 'ov_compiled_model'):
+            import openvino
+            core = openvino.Core()
+            graph = core.read_model(glob.glob(os.path.join(self.path, '*.xml'))[0])
+            runtime.ov_compiled_model = core.compile_model(
+                graph, 'CPU', {'PERFORMANCE_HINT': 'LATENCY', 'INFERENCE_NUM_THREADS': self.threads},
+            )
+        else:
+            log.warning("Couldn't limit %s to %d threads, using the runtime default", self.backend, self.threads)
@@ -0,0 +1,17 @@
+import numpy as np
+
+# people are kept as one (N, NUM_KEYPOINTS, 3) float32 array per frame:
+# x and y normalized to 0-1 across the frame, plus the model's confidence.
+# keypoint order is COCO, the same order YOLO pose models output
+NUM_KEYPOINTS = 17
+LEFT_WRIST = 9
+RIGHT_WRIST = 10
+HANDS = [LEFT_WRIST, RIGHT_WRIST]
+
+# keypoints the model is less sure about than this are treated as not found
+MIN_CONFIDENCE = 0.5
+
+
+def empty_poses():
+    """an array holding no people"""
+    return np.empty((0, NUM_KEYPOINTS, 3), dtype=np.float32)
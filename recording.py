@@ -0,0 +1,103 @@
+import os
+import struct
+
+import numpy as np
+
+from poses import NUM_KEYPOINTS
+
+MAGIC = b'KPR1'
+# per frame: capture time (time.monotonic()), people in the frame
+FRAME_HEADER = struct.Struct('<dI')
+
+
+class KeypointRecorder:
+    """
+    appends every tracked frame's keypoints to a compact binary file
+
+    the file is MAGIC followed by one FRAME_HEADER per frame and then
+    people * 17 * 3 little-endian float16 values, (x, y, confidence) per
+    keypoint as in poses.py. float16 keeps positions to about 0.05% of the frame
+    """
+    def __init__(self, path, append=False):
+        """
+        :param path: file to write, replaced if it exists
+        :param append: carry on with the recording already in path instead of replacing it,
+                       a frame cut off mid-write at its end is dropped first
+        """
+        self.path = path
+        end = recording_end(path) if append else None
+        if end is None:
+            self._file = open(path, 'wb')
+            self._file.write(MAGIC)
+        else:
+            self._file = open(path, 'r+b')
+            self._file.truncate(end)
+            self._file.seek(end)
+
+    def write(self, timestamp, poses):
+        """
+        :param timestamp: time.monotonic() the frame was captured
+        :param poses: (N, 17, 3) array
+        """
+        self._file.write(FRAME_HEADER.pack(timestamp, len(poses)))
+        self._file.write(np.asarray(poses, dtype='<f2').tobytes())
+        # the tracking thread is a daemon, a recording cut short by ctrl-c should still have its frames
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def recording_end(path):
+    """
+    returns the byte offset just past the last complete frame of a recording,
+    or None if path doesn't exist or isn't a keypoint recording
+
+    only the frame headers are read, the keypoints are skipped over
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        size = os.fstat(f.fileno()).st_size
+        end = f.tell()
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return end
+            _, people = FRAME_HEADER.unpack(header)
+            frame_end = end + FRAME_HEADER.size + people * NUM_KEYPOINTS * 3 * 2
+            if frame_end > size:
+                return end
+            end = frame_end
+            f.seek(end)
+
+
+def read_recording(path):
+    """
+    yields (timestamp, poses) for every frame of a recording made by KeypointRecorder
+
+    :param path: the recording
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a keypoint recording")
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            timestamp, people = FRAME_HEADER.unpack(header)
+            count = people * NUM_KEYPOINTS * 3
+            data = f.read(count * 2)
+            if len(data) < count * 2:
+                # the recording was cut off mid-frame
+                return
+            data = np.frombuffer(data, dtype='<f2')
+            yield timestamp, data.astype(np.float32).reshape(people, NUM_KEYPOINTS, 3)
@@ -0,0 +1,67 @@
+import argparse
+import logging
+
+from controller import slot_hands
+from main import STALE_AFTER
+from mixer3 import SimultaneousWAVPlayer
+from person_tracker import SlotTracker
+from recording import read_recording
+from rtlog import setup_logging
+from stem_watcher import find_stems
+
+log = logging.getLogger(__name__)
+
+
+def recorded_automation(path, slots=None):
+    """
+    turns a keypoint recording into (seconds, levels) automation, the same way main.py sets volumes live
+
+    :param path: recording made with main.py --record
+    :param slots: see controller.run_tracking
+    """
+    tracker = SlotTracker(slots) if slots else None
+    first = previous = None
+    for recorded_at, poses in read_recording(path):
+        if first is None:
+            first = previous = recorded_at
+        if recorded_at - previous > STALE_AFTER:
+            # tracking stalled, main.py would have gone silent
+            yield previous + STALE_AFTER - first, []
+        previous = recorded_at
+        hand_heights, _ = slot_hands(poses, tracker, recorded_at)
+        levels = [min(max(height, 0), 1) for height in hand_heights]
+        yield recorded_at - first, levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="render a mix to a file faster than real time")
+    parser.add_argument("output", help="audio file to write, e.g. show.wav or show.flac")
+    parser.add_argument("--replay", metavar="FILE", help="keypoint recording to take the volumes from")
+    parser.add_argument("--duration", type=float,
+                        help="seconds to render (default: the length of the recording, or of the stems)")
+    parser.add_argument("--blocksize", type=int, default=512, help="stream block size to reproduce")
+    parser.add_argument("--subtype", default="FLOAT", help="soundfile subtype, e.g. PCM_16")
+    args = parser.parse_args()
+
+    setup_logging()
+    keyword = "SOUND ART"
+    # the order main.py plays them in, so every slot gets the same stems as live
+    wav_files = find_stems('.', keyword)
+    if not wav_files:
+        log.error("No WAV files found in the directory")
+        return
+
+    player = SimultaneousWAVPlayer(wav_files, streaming=True)
+    automation = []
+    if args.replay:
+        automation = list(recorded_automation(args.replay, slots=(len(wav_files) + 1) // 2))
+        # silent until the first tracked frame, like main.py
+        player.set_volumes([])
+    duration = args.duration
+    if duration is None:
+        duration = automation[-1][0] if automation else player.max_length / player.sample_rate
+    player.render(args.output, duration, automation, args.blocksize, args.subtype)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+FORMAT = "%(asctime)s %(levelname)-7s %(threadName)s %(name)s: %(message)s"
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    lets every call site log at most burst records per interval seconds
+
+    the first record through after a quiet spell says how many were dropped,
+    so a message fired every frame can't flood the terminal
+    """
+    def __init__(self, interval=1.0, burst=5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self._sites = {}  # (path, line) -> [window start, passed in window, dropped]
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        site = self._sites.get(key)
+        if site is None:
+            site = self._sites[key] = [record.created, 0, 0]
+        if record.created - site[0] >= self.interval:
+            site[0] = record.created
+            site[1] = 0
+        if site[1] >= self.burst:
+            site[2] += 1
+            return False
+        site[1] += 1
+        if site[2]:
+            record.msg = f"{record.msg} ({site[2]} similar messages suppressed)"
+            site[2] = 0
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the writer thread
+
+    the stock handler formats every record in the thread that logs it, which is
+    exactly the thread we don't want to slow down
+    """
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=logging.INFO, interval=1.0, burst=5, stream=None):
+    """
+    routes all logging through a queue drained by a background writer thread
+
+    logging calls then never block on terminal I/O, calling this more than once does nothing
+
+    :param level: lowest level that gets written
+    :param interval: see RateLimitFilter
+    :param burst: see RateLimitFilter
+    :param stream: where to write, defaults to stderr
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(RateLimitFilter(interval, burst))
+
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(logging.Formatter(FORMAT))
+    _listener = logging.handlers.QueueListener(log_queue, writer)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
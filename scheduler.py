@@ -0,0 +1,182 @@
+import time
+
+import numpy as np
+
+from poses import MIN_CONFIDENCE, empty_poses
+
+# how quickly the cost and frame interval estimates follow new measurements
+SMOOTHING = 0.2
+
+
+def centroids(poses):
+    """
+    returns the (N, 2) mean position of every person's confident keypoints
+
+    :param poses: (N, 17, 3) array, see poses.py
+    """
+    weights = (poses[..., 2] >= MIN_CONFIDENCE).astype(np.float32)
+    # people with no confident keypoint fall back to the plain mean
+    weights[weights.sum(axis=1) == 0] = 1
+    return (poses[..., :2] * weights[..., None]).sum(axis=1) / weights.sum(axis=1)[:, None]
+
+
+def match_people(previous, current, max_distance=0.2):
+    """
+    pairs up people in two frames by nearest centroid, closest pairs first
+
+    :param previous: (M, 17, 3) poses from the earlier frame
+    :param current: (N, 17, 3) poses from the later frame
+    :param max_distance: centroids further apart than this (in frame widths) never match
+    :return: list of (current index, previous index)
+    """
+    if not len(previous) or not len(current):
+        return []
+    distances = np.linalg.norm(centroids(current)[:, None] - centroids(previous)[None], axis=2)
+    matches = []
+    used_current, used_previous = set(), set()
+    for flat in np.argsort(distances, axis=None):
+        i, j = np.unravel_index(flat, distances.shape)
+        if distances[i, j] > max_distance:
+            break
+        if i in used_current or j in used_previous:
+            continue
+        matches.append((int(i), int(j)))
+        used_current.add(i)
+        used_previous.add(j)
+    return matches
+
+
+class AdaptiveScheduler:
+    """
+    decides per frame how much inference to spend, so hand heights keep
+    updating at camera rate while the model only gets a share of the CPU
+
+    every frame earns budget * frame interval seconds of inference time. with
+    enough saved up, a frame runs full-frame detection (every full_every frames,
+    or whenever nobody is being tracked) or inference on a crop around the people
+    already found. otherwise the keypoints are predicted from their last measured
+    position and velocity
+    """
+    def __init__(self, detect, budget=0.5, target_fps=None, full_every=10, crop_margin=0.3,
+                 crop_imgsz=320, max_extrapolation=0.25):
+        """
+        :param detect: function called as detect(image, imgsz) returning (N, 17, 3) poses normalized to image
+        :param budget: share of each frame interval inference may use, 1 means every frame if it can keep up
+        :param target_fps: frame rate the budget is computed for, defaults to the measured camera rate
+        :param full_every: frames between full-frame detections, which is how soon new people are found
+        :param crop_margin: how much bigger than the people's bounding box a crop is, as a fraction of its size
+        :param crop_imgsz: inference resolution for crops, ignored by exported backends
+        :param max_extrapolation: seconds keypoints may be predicted ahead of the last measurement
+        """
+        self.detect = detect
+        self.budget = budget
+        self.target_fps = target_fps
+        self.full_every = full_every
+        self.crop_margin = crop_margin
+        self.crop_imgsz = crop_imgsz
+        self.max_extrapolation = max_extrapolation
+        self.counts = {'full': 0, 'crop': 0, 'predicted': 0}
+
+        self._frame_interval = 1 / 30
+        self._last_frame_at = None
+        self._credit = 0.0
+        self._costs = {'full': 0.0, 'crop': 0.0}
+        self._frames_since_full = full_every
+        self._measured = None
+        self._velocity = None
+        self._measured_at = None
+
+    def process(self, frame, captured_at=None):
+        """
+        returns the (N, 17, 3) poses for frame, measured or predicted
+
+        :param frame: BGR camera frame
+        :param captured_at: time.monotonic() the frame was captured, defaults to now
+        """
+        now = time.monotonic() if captured_at is None else captured_at
+        if self._last_frame_at is not None:
+            self._frame_interval += SMOOTHING * (now - self._last_frame_at - self._frame_interval)
+        self._last_frame_at = now
+
+        period = 1 / self.target_fps if self.target_fps else self._frame_interval
+        # saving up is capped, so a quiet spell can't turn into a burst of back to back inference
+        self._credit = min(self._credit + self.budget * period, max(self._costs.values()) + period)
+        self._frames_since_full += 1
+
+        nobody = self._measured is None or not len(self._measured)
+        if nobody or self._frames_since_full >= self.full_every:
+            # a full detection is due, save up for it instead of spending on crops.
+            # new people must show up eventually, even if the budget never allows it
+            if self._credit >= self._costs['full'] or self._frames_since_full >= 3 * self.full_every:
+                mode = 'full'
+            else:
+                mode = 'predicted'
+        elif self._credit >= self._costs['crop']:
+            mode = 'crop'
+        else:
+            mode = 'predicted'
+        self.counts[mode] += 1
+
+        if mode == 'predicted':
+            return self._predict(now)
+
+        start = time.perf_counter()
+        poses = self._detect(frame) if mode == 'full' else self._detect_in_crop(frame)
+        cost = time.perf_counter() - start
+        self._costs[mode] += SMOOTHING * (cost - self._costs[mode]) if self._costs[mode] else cost
+        self._credit -= cost
+        if mode == 'full':
+            self._frames_since_full = 0
+        self._observe(poses, now)
+        return poses
+
+    def _detect(self, frame):
+        return self.detect(frame, None)
+
+    def _detect_in_crop(self, frame):
+        frame_height, frame_width = frame.shape[:2]
+        known = self._predict(self._last_frame_at)
+        confident = known[..., 2] >= MIN_CONFIDENCE
+        points = known[..., :2][confident] if confident.any() else known[..., :2].reshape(-1, 2)
+        low = points.min(axis=0)
+        high = points.max(axis=0)
+        # plus a little extra so a single keypoint still gets a usable crop
+        margin = (high - low) * self.crop_margin + 0.05
+        x0, y0 = np.clip(low - margin, 0, 1) * (frame_width, frame_height)
+        x1, y1 = np.clip(high + margin, 0, 1) * (frame_width, frame_height)
+        x0, y0, x1, y1 = int(x0), int(y0), max(int(x1), int(x0) + 1), max(int(y1), int(y0) + 1)
+
+        crop = frame[y0:y1, x0:x1]
+        poses = self.detect(crop, self.crop_imgsz)
+        # crop-relative back to frame-relative coordinates
+        poses[..., 0] = (poses[..., 0] * (x1 - x0) + x0) / frame_width
+        poses[..., 1] = (poses[..., 1] * (y1 - y0) + y0) / frame_height
+        return poses
+
+    def _observe(self, poses, now):
+        """stores a measurement and estimates each person's keypoint velocity from the last one"""
+        velocity = np.zeros_like(poses[..., :2])
+        if self._measured is not None and now > self._measured_at:
+            dt = now - self._measured_at
+            for i, j in match_people(self._measured, poses):
+                both = (poses[i, :, 2] >= MIN_CONFIDENCE) & (self._measured[j, :, 2] >= MIN_CONFIDENCE)
+                velocity[i, both] = (poses[i, both, :2] - self._measured[j, both, :2]) / dt
+        self._measured = poses
+        self._velocity = velocity
+        self._measured_at = now
+
+    def _predict(self, now):
+        """constant-velocity guess of where everyone is at time now"""
+        if self._measured is None:
+            return empty_poses()
+        predicted = self._measured.copy()
+        ahead = min(now - self._measured_at, self.max_extrapolation)
+        predicted[..., :2] = np.clip(predicted[..., :2] + self._velocity * ahead, 0, 1)
+        return predicted
+
+    def report(self):
+        """how many frames took each path and what inference currently costs"""
+        total = sum(self.counts.values()) or 1
+        shares = ', '.join(f"{mode} {count / total:.0%}" for mode, count in self.counts.items())
+        return (f"{shares} of {total} frames, full {self._costs['full'] * 1000:.1f} ms, "
+                f"crop {self._costs['crop'] * 1000:.1f} ms, frame interval {self._frame_interval * 1000:.1f} ms")
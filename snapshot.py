@@ -0,0 +1,90 @@
+import itertools
+import threading
+import time
+
+
+class Snapshot:
+    """
+    one frame's worth of tracking output, never modified after it's published
+
+    :param seq: increases by one for every published frame
+    :param timestamp: time.monotonic() when the camera frame was captured
+    :param hand_heights: list of hand heights [L0, R0, L1, R1, ...]
+    :param frame: the camera frame, only kept when something wants to draw a preview
+    :param poses: (N, 17, 3) keypoints of the people found in frame, see poses.py
+    :param hand_x: horizontal hand positions in the same order as hand_heights, NaN for unseen hands
+    """
+    __slots__ = ('seq', 'timestamp', 'hand_heights', 'frame', 'poses', 'hand_x')
+
+    def __init__(self, seq, timestamp, hand_heights, frame=None, poses=None, hand_x=None):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.hand_heights = hand_heights
+        self.frame = frame
+        self.poses = poses
+        self.hand_x = hand_x
+
+    def age(self):
+        """seconds since the frame behind this snapshot was captured"""
+        return time.monotonic() - self.timestamp
+
+
+class LatestSnapshot:
+    """
+    single-slot channel that only ever holds the newest snapshot
+
+    publishing swaps one reference, which is atomic in CPython, so latest()
+    never takes a lock and never sees a half-written snapshot. old
+    frames are simply dropped instead of piling up like they did in a queue.
+    wait_newer() lets a consumer sleep until the next frame instead of polling
+    """
+    def __init__(self):
+        self._snapshot = None
+        self._seq = itertools.count(1)
+        self._published = threading.Condition()
+
+    def publish(self, hand_heights, timestamp=None, frame=None, poses=None, hand_x=None):
+        """
+        replaces the current snapshot
+
+        :param hand_heights: list of hand heights for the frame
+        :param timestamp: capture time from time.monotonic(), defaults to now
+        :param frame: see Snapshot
+        :param poses: see Snapshot
+        :param hand_x: see Snapshot
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        snapshot = Snapshot(next(self._seq), timestamp, hand_heights, frame, poses, hand_x)
+        self._snapshot = snapshot
+        with self._published:
+            self._published.notify_all()
+        return snapshot
+
+    def latest(self):
+        """returns the newest snapshot, or None if nothing was published yet"""
+        return self._snapshot
+
+    def wait_newer(self, seq, timeout=None):
+        """
+        blocks until a snapshot newer than seq is published
+
+        :param seq: sequence number of the last snapshot the caller has seen, 0 for none
+        :param timeout: seconds to wait at most
+        :return: the newest snapshot, or None if nothing newer arrived in time
+        """
+        def is_newer():
+            snapshot = self._snapshot
+            return snapshot is not None and snapshot.seq > seq
+
+        with self._published:
+            self._published.wait_for(is_newer, timeout)
+        snapshot = self._snapshot
+        return snapshot if snapshot is not None and snapshot.seq > seq else None
+
+    def age(self):
+        """seconds since the newest snapshot was captured, inf if there is none"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return float('inf')
+        return snapshot.age()
@@ -0,0 +1,91 @@
+import glob
+import os
+import time
+
+import cv2
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class ImageDirectorySource:
+    """
+    reads the images in a directory in name order
+
+    has the parts of the cv2.VideoCapture interface run_tracking uses
+    """
+    def __init__(self, path):
+        """
+        :param path: directory holding the frames
+        """
+        self.paths = sorted(
+            p for p in glob.glob(os.path.join(path, '*')) if p.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self.index = 0
+
+    def isOpened(self):
+        return self.index < len(self.paths)
+
+    def read(self):
+        if not self.isOpened():
+            return False, None
+        frame = cv2.imread(self.paths[self.index])
+        self.index += 1
+        return frame is not None, frame
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self.index = len(self.paths)
+
+
+class PacedSource:
+    """
+    hands out a file's frames no faster than fps, the way a live camera would
+    """
+    def __init__(self, source, fps):
+        """
+        :param source: VideoCapture-like object
+        :param fps: frames per second to deliver
+        """
+        self.source = source
+        self.interval = 1 / fps
+        self._next_frame = None
+
+    def read(self):
+        now = time.monotonic()
+        if self._next_frame is None:
+            self._next_frame = now
+        time.sleep(max(0, self._next_frame - now))
+        self._next_frame += self.interval
+        return self.source.read()
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+
+def is_camera(spec):
+    """True if open_source would open spec as a camera, which never runs out the way files do"""
+    return isinstance(spec, int) or str(spec).isdigit()
+
+
+def open_source(spec=0, realtime=True, fps=30):
+    """
+    opens a camera, a video file or a directory of images as a frame source
+
+    :param spec: camera index (int or digit string), path to a video file, or path to an image directory
+    :param realtime: deliver file frames at their frame rate, False reads them as fast as possible
+    :param fps: frame rate for image directories and videos that don't say
+    """
+    if is_camera(spec):
+        return cv2.VideoCapture(int(spec))
+
+    if os.path.isdir(spec):
+        source = ImageDirectorySource(spec)
+        rate = fps
+    else:
+        source = cv2.VideoCapture(spec)
+        rate = source.get(cv2.CAP_PROP_FPS) or fps
+    if not source.isOpened():
+        raise ValueError(f"Could not open video source {spec}")
+    return PacedSource(source, rate) if realtime else source
@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def equal_power(x):
+    """constant power, a source sounds as loud between two outputs as on one"""
+    angle = x * (np.pi / 2)
+    return np.cos(angle), np.sin(angle)
+
+
+def linear(x):
+    """constant amplitude, 6 dB down halfway between outputs"""
+    return 1 - x, x
+
+
+def compromise(x):
+    """halfway between the other two, 4.5 dB down halfway between outputs"""
+    near, far = equal_power(x)
+    return np.sqrt((1 - x) * near), np.sqrt(x * far)
+
+
+# gains for the two outputs either side of a source, given how far (0 to 1) it is from the first to the second
+PAN_LAWS = {'equal_power': equal_power, 'linear': linear, 'compromise': compromise}
+
+
+def pan_matrix(positions, outputs, law='equal_power'):
+    """
+    (tracks, outputs) gains that place every track between the two outputs nearest its position
+
+    outputs are spread evenly along a line, the first at position 0 and the last at 1
+
+    :param positions: (tracks,) positions between 0 and 1
+    :param outputs: number of output channels
+    :param law: one of PAN_LAWS
+    :return: float32 matrix, row t holds track t's gain on every output
+    """
+    if law not in PAN_LAWS:
+        raise ValueError(f"Unknown pan law {law!r}, expected one of {', '.join(PAN_LAWS)}")
+    positions = np.clip(np.asarray(positions, dtype=float), 0, 1)
+    matrix = np.zeros((len(positions), outputs), dtype=np.float32)
+    if outputs == 1:
+        matrix[:] = 1
+        return matrix
+    place = positions * (outputs - 1)
+    # a source right on the last output still pans between the last two
+    low = np.minimum(place.astype(int), outputs - 2)
+    near, far = PAN_LAWS[law](place - low)
+    rows = np.arange(len(positions))
+    matrix[rows, low] = near
+    matrix[rows, low + 1] = far
+    return matrix
@@ -0,0 +1,76 @@
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+
+def find_stems(directory='.', keyword="SOUND ART"):
+    """returns the WAV files in directory with keyword in their name, sorted"""
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory) if f.endswith('.wav') and keyword in f
+    )
+
+
+class StemWatcher(threading.Thread):
+    """
+    polls a directory and has the player switch to the new stem set whenever
+    a matching file is added, removed or rewritten
+
+    only files whose size or mtime changed are really reloaded: pass a
+    StemCache (or stream) and the untouched ones come straight back from the
+    cache (or the memory map) instead of being decoded again
+    """
+    def __init__(self, player, directory='.', keyword="SOUND ART", interval=2.0, swap_crossfade=1.0,
+                 **load_settings):
+        """
+        :param player: the playing SimultaneousWAVPlayer
+        :param directory: directory to watch
+        :param keyword: see find_stems
+        :param interval: seconds between scans
+        :param swap_crossfade: see SimultaneousWAVPlayer.load_next
+        :param load_settings: other keyword arguments for load_next, e.g. streaming and cache
+        """
+        super().__init__(name='stem-watcher', daemon=True)
+        self.player = player
+        self.directory = directory
+        self.keyword = keyword
+        self.interval = interval
+        self.swap_crossfade = swap_crossfade
+        self.load_settings = load_settings
+        self._stop_event = threading.Event()
+        self._signatures = self._scan()
+
+    def _scan(self):
+        """{path: (size, mtime)} of every matching file"""
+        signatures = {}
+        for path in find_stems(self.directory, self.keyword):
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                # deleted between listing and stat
+                continue
+            signatures[path] = (info.st_size, info.st_mtime_ns)
+        return signatures
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            signatures = self._scan()
+            if signatures == self._signatures:
+                continue
+            # a file still being copied in keeps changing, wait until it holds still
+            if self._stop_event.wait(self.interval) or signatures != self._scan():
+                continue
+
+            changed = [path for path, signature in signatures.items() if self._signatures.get(path) != signature]
+            removed = [path for path in self._signatures if path not in signatures]
+            self._signatures = signatures
+            if len(signatures) < 2:
+                log.warning("Only %d stems left in %s, keeping the current set", len(signatures), self.directory)
+                continue
+            log.info("Stems changed (%d new or modified, %d removed), reloading",
+                     len(changed), len(removed))
+            self.player.load_next(list(signatures), self.swap_crossfade, **self.load_settings).join()
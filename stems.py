@@ -0,0 +1,427 @@
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import soundfile as sf
+
+try:
+    from scipy.signal import resample_poly
+except ImportError:
+    resample_poly = None
+
+log = logging.getLogger(__name__)
+
+# WAVE format tags we know how to read straight off disk
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (format tag, bits per sample) -> (numpy dtype, scale into [-1, 1])
+MAPPABLE_FORMATS = {
+    (WAVE_FORMAT_PCM, 16): ('<i2', 1 / 32768),
+    (WAVE_FORMAT_PCM, 32): ('<i4', 1 / 2147483648),
+    (WAVE_FORMAT_IEEE_FLOAT, 32): ('<f4', 1.0),
+    (WAVE_FORMAT_IEEE_FLOAT, 64): ('<f8', 1.0),
+}
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mus277', 'stems')
+
+# ITU-R BS.775 fold-down of 5.1 (L, R, C, LFE, Ls, Rs) to stereo, the LFE is left out
+SURROUND_DOWNMIX = np.array(
+    [[1, 0], [0, 1], [0.7071, 0.7071], [0, 0], [0.7071, 0], [0, 0.7071]], dtype=np.float32,
+)
+
+
+class Stem:
+    """
+    one audio file, either memory-mapped from disk or decoded into RAM
+
+    data is always (frames, channels) -- mono files stay mono and get
+    upmixed by the mixer, samples are multiplied by scale to land in [-1, 1]
+    """
+    def __init__(self, path, data, sample_rate, scale=1.0, mapped=False):
+        self.path = path
+        self.data = data
+        self.sample_rate = sample_rate
+        self.scale = np.float32(scale)
+        self.mapped = mapped
+
+    @property
+    def frames(self):
+        return self.data.shape[0]
+
+    @property
+    def channels(self):
+        return self.data.shape[1]
+
+
+def read_wav_layout(path):
+    """
+    finds the sample format and where the sample data starts in a WAV file
+
+    :param path: path to the file
+    :return: (format tag, channels, sample rate, bits, data offset, data size), or None if it isn't a WAV
+    """
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = struct.unpack('<4sI', chunk)
+
+            if chunk_id == b'data':
+                if fmt is None:
+                    return None
+                return fmt + (f.tell(), size)
+
+            if chunk_id == b'fmt ':
+                body = f.read(size)
+                if len(body) < 16:
+                    return None
+                tag, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+                if tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    # the real format tag is the start of the subformat GUID
+                    tag = struct.unpack('<H', body[24:26])[0]
+                fmt = (tag, channels, sample_rate, bits)
+            else:
+                f.seek(size, 1)
+
+            # chunks are word aligned
+            f.seek(size % 2, 1)
+
+
+def map_wav(path):
+    """
+    memory-maps the samples of a PCM/float WAV file without decoding it
+
+    :param path: path to the file
+    :return: a mapped Stem, or None if the format can't be read in place (e.g. 24 bit, FLAC)
+    """
+    layout = read_wav_layout(path)
+    if layout is None:
+        return None
+    tag, channels, sample_rate, bits, offset, size = layout
+    if (tag, bits) not in MAPPABLE_FORMATS or channels == 0:
+        return None
+    dtype, scale = MAPPABLE_FORMATS[(tag, bits)]
+
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mapping, 'madvise'):
+        # playback reads front to back, let the kernel read ahead for us
+        mapping.madvise(mmap.MADV_SEQUENTIAL)
+
+    # some writers leave the data size at 0xFFFFFFFF, trust the file size instead
+    size = min(size, len(mapping) - offset)
+    frame_size = channels * np.dtype(dtype).itemsize
+    frames = size // frame_size
+    data = np.frombuffer(mapping, dtype=dtype, count=frames * channels, offset=offset)
+    return Stem(path, data.reshape(frames, channels), sample_rate, scale, mapped=True)
+
+
+def decode(path):
+    """
+    decodes a whole file into a float32 (frames, channels) array
+
+    :param path: path to the file
+    """
+    data, sample_rate = sf.read(path, dtype='float32', always_2d=True)
+    return Stem(path, data, sample_rate)
+
+
+def downmix_matrix(channels):
+    """
+    returns the (channels, 2) matrix that takes a file's channels to stereo
+
+    mono goes to both sides, 5.1 uses SURROUND_DOWNMIX, any other layout
+    alternates its channels between left and right and averages each side
+    """
+    if channels == 1:
+        return np.ones((1, 2), dtype=np.float32)
+    if channels == 6:
+        return SURROUND_DOWNMIX
+    matrix = np.zeros((channels, 2), dtype=np.float32)
+    matrix[0::2, 0] = 1
+    matrix[1::2, 1] = 1
+    return matrix / matrix.sum(axis=0)
+
+
+def needs_normalizing(stem, sample_rate=None):
+    """
+    True if the mixer can't play stem as it is
+
+    mono is fine, the mixer upmixes it while it copies anyway
+
+    :param sample_rate: rate every stem has to be at, None accepts the stem's own
+    """
+    return stem.channels > 2 or (sample_rate is not None and stem.sample_rate != sample_rate)
+
+
+def normalize(stem, sample_rate):
+    """
+    converts a stem to a float32 array at sample_rate with at most two channels
+
+    more than two channels are mixed down to stereo first so there's less to
+    resample, mono stays (frames, 1) since the mixer upmixes it while it copies.
+    rate changes use a polyphase filter, e.g. 160/147 for 44.1 to 48 kHz
+
+    :param stem: any Stem, mapped integer samples included
+    :param sample_rate: rate to convert to
+    """
+    data = np.multiply(stem.data, stem.scale, dtype=np.float32)
+    if stem.channels > 2:
+        data = data @ downmix_matrix(stem.channels)
+    if stem.sample_rate != sample_rate:
+        if resample_poly is None:
+            raise ValueError(f"{stem.path} is {stem.sample_rate} Hz, converting it to {sample_rate} Hz needs scipy")
+        divisor = math.gcd(sample_rate, stem.sample_rate)
+        data = resample_poly(data, sample_rate // divisor, stem.sample_rate // divisor, axis=0)
+        log.info("Resampled %s from %d to %d Hz", stem.path, stem.sample_rate, sample_rate)
+    return Stem(stem.path, np.ascontiguousarray(data, dtype=np.float32), sample_rate)
+
+
+def open_stem(path, streaming=False, cache=None, length=None, sample_rate=None):
+    """
+    opens one audio file for the player
+
+    :param path: path to the file
+    :param streaming: memory-map WAV files instead of decoding them, other formats are still decoded
+    :param cache: optional StemCache used for anything that has to be decoded
+    :param length: frames the cached copy gets trimmed to
+    :param sample_rate: rate to convert to, None keeps the file's own
+    """
+    if streaming:
+        stem = map_wav(path)
+        if stem is not None and not needs_normalizing(stem, sample_rate):
+            return stem
+    if cache is not None:
+        return cache.load(path, length, sample_rate)
+    stem = decode(path)
+    if needs_normalizing(stem, sample_rate):
+        stem = normalize(stem, sample_rate or stem.sample_rate)
+    return stem
+
+
+def load_stems(paths, streaming=False, cache=None, length=None, workers=None, sample_rate=None):
+    """
+    opens every file concurrently, libsndfile and the resampler release the GIL while they work
+
+    stops at the first file that fails to load and raises a ValueError naming it
+
+    :param paths: paths to audio files
+    :param streaming: see open_stem
+    :param cache: see open_stem
+    :param length: see open_stem
+    :param workers: number of loader threads, defaults to one per core
+    :param sample_rate: see open_stem
+    :return: (stems in the same order as paths, {path: seconds it took to load})
+    """
+    timings = {}
+
+    def load(path):
+        start = time.perf_counter()
+        stem = open_stem(path, streaming, cache, length, sample_rate)
+        timings[path] = time.perf_counter() - start
+        return stem
+
+    pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+    futures = {pool.submit(load, path): path for path in paths}
+    try:
+        for future in as_completed(futures):
+            error = future.exception()
+            if error is not None:
+                raise ValueError(f"Failed to load {futures[future]}: {error}") from error
+    finally:
+        # on failure, don't wait for files still queued behind the bad one
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    stems = {path: future.result() for future, path in futures.items()}
+    return [stems[path] for path in paths], timings
+
+
+def format_timings(timings):
+    """
+    formats load timings from load_stems, slowest file first
+
+    :param timings: {path: seconds}
+    """
+    lines = [
+        f"{seconds * 1000:9.1f} ms  {os.path.basename(path)}"
+        for path, seconds in sorted(timings.items(), key=lambda item: -item[1])
+    ]
+    return '\n'.join(lines)
+
+
+def probe(path):
+    """
+    reads an audio file's header, raising the same ValueError load_stems does if it can't
+
+    :param path: path to an audio file
+    :return: soundfile info
+    """
+    try:
+        return sf.info(path)
+    except Exception as error:
+        raise ValueError(f"Failed to load {path}: {error}") from error
+
+
+def shortest_length(paths, sample_rate=None):
+    """
+    returns the frame count of the shortest file, read from the headers only
+
+    :param paths: paths to audio files
+    :param sample_rate: count frames at this rate, as they'll be after resampling
+    """
+    lengths = []
+    for path in paths:
+        info = probe(path)
+        lengths.append(info.frames * (sample_rate or info.samplerate) // info.samplerate)
+    return min(lengths)
+
+
+def common_sample_rate(paths):
+    """
+    returns the sample rate most of the files already have, so the fewest need resampling
+
+    ties go to the rate of the earliest file
+
+    :param paths: paths to audio files
+    """
+    return Counter(probe(path).samplerate for path in paths).most_common(1)[0][0]
+
+
+class StemCache:
+    """
+    on-disk cache of decoded float32 stems, loaded back memory-mapped
+
+    stems that need resampling or downmixing are stored converted, so that
+    only happens on the first load. files are looked up by (path, size, mtime) and entries are stored under a
+    hash of the file contents, so touching or renaming a file doesn't force a
+    re-decode. least recently used entries go once the cache passes max_bytes
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=4 * 1024 ** 3):
+        """
+        :param directory: where the decoded stems and index.json live
+        :param max_bytes: size cap for all cached stems together
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.timings = []  # (path, hit, seconds) for every load, for the startup report
+        self._lock = threading.Lock()
+        self._in_use = set()
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, 'index.json')
+        self._index = self._read_index()
+
+    def _read_index(self):
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'files': {}, 'entries': {}}
+
+    def _write_index(self):
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def _content_hash(self, path):
+        """hashes the file contents, reusing the last hash while size and mtime haven't changed"""
+        info = os.stat(path)
+        key = os.path.abspath(path)
+        with self._lock:
+            known = self._index['files'].get(key)
+        if known and known['size'] == info.st_size and known['mtime_ns'] == info.st_mtime_ns:
+            return known['hash']
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        with self._lock:
+            self._index['files'][key] = {
+                'size': info.st_size, 'mtime_ns': info.st_mtime_ns, 'hash': content_hash,
+            }
+        return content_hash
+
+    def _evict(self):
+        """drops least recently used entries until the cache fits under max_bytes again"""
+        entries = self._index['entries']
+        total = sum(entry['bytes'] for entry in entries.values())
+        for name in sorted(entries, key=lambda name: entries[name]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if name in self._in_use:
+                continue
+            total -= entries.pop(name)['bytes']
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def load(self, path, length=None, sample_rate=None):
+        """
+        returns the stem for path from the cache, decoding and storing it on a miss
+
+        :param path: path to the audio file
+        :param length: trim the stem to this many frames
+        :param sample_rate: see open_stem
+        """
+        start = time.perf_counter()
+        name = (f"{self._content_hash(path)}_{sample_rate or 'native'}"
+                f"_{'full' if length is None else length}.npy")
+        entry_path = os.path.join(self.directory, name)
+
+        with self._lock:
+            entry = self._index['entries'].get(name)
+        hit = entry is not None and os.path.exists(entry_path)
+        if not hit:
+            stem = decode(path)
+            if needs_normalizing(stem, sample_rate):
+                stem = normalize(stem, sample_rate or stem.sample_rate)
+            # unique per thread in case two identical files are loaded at once
+            tmp_path = f"{entry_path}.{threading.get_ident()}.tmp.npy"
+            np.save(tmp_path, np.ascontiguousarray(stem.data[:length]))
+            os.replace(tmp_path, entry_path)
+            entry = {'bytes': os.path.getsize(entry_path), 'sample_rate': stem.sample_rate}
+
+        # zero-copy, pages come in from the file as playback touches them
+        data = np.load(entry_path, mmap_mode='r')
+
+        with self._lock:
+            entry['last_used'] = time.time()
+            self._index['entries'][name] = entry
+            self._in_use.add(name)
+            if not hit:
+                self._evict()
+            self._write_index()
+
+        self.timings.append((path, hit, time.perf_counter() - start))
+        return Stem(path, data, entry['sample_rate'], mapped=True)
+
+    def report(self):
+        """returns a short per-file timing report of every load so far, to compare cold and warm starts"""
+        lines = [
+            f"{'hit ' if hit else 'miss'} {seconds * 1000:9.1f} ms  {os.path.basename(path)}"
+            for path, hit, seconds in self.timings
+        ]
+        hits = sum(1 for _, hit, _ in self.timings if hit)
+        total = sum(seconds for _, _, seconds in self.timings)
+        lines.append(f"{hits}/{len(self.timings)} stems from cache, {total:.2f} s loading")
+        return '\n'.join(lines)
@@ -0,0 +1,204 @@
+import http.server
+import os
+import threading
+
+import numpy as np
+
+# PortAudio status flags an output stream can report, see sounddevice.CallbackFlags
+XRUN_FLAGS = ('output_underflow', 'output_overflow', 'priming_output')
+
+
+class RingStats:
+    """
+    fixed-size ring buffer of float samples
+
+    add() only writes into a preallocated array so it's safe to call from the
+    audio callback, readers copy what's there and compute stats on their own time
+    """
+    def __init__(self, size=4096):
+        """
+        :param size: how many of the most recent samples to keep
+        """
+        self._values = np.zeros(size)
+        self._count = 0
+        self._total = 0.0
+
+    def add(self, value):
+        self._values[self._count % len(self._values)] = value
+        self._count += 1
+        self._total += value
+
+    @property
+    def count(self):
+        """total samples ever added, including ones that were overwritten"""
+        return self._count
+
+    @property
+    def total(self):
+        """sum of every sample ever added"""
+        return self._total
+
+    def values(self):
+        """returns a copy of the samples currently held, oldest order not guaranteed"""
+        return self._values[:min(self._count, len(self._values))].copy()
+
+    def percentiles(self, q=(50, 90, 99)):
+        """
+        returns the requested percentiles of the held samples, or None if there are none
+
+        :param q: percentiles between 0 and 100
+        """
+        values = self.values()
+        if not len(values):
+            return None
+        return np.percentile(values, q)
+
+    def histogram(self, bins=20, range=None):
+        """
+        returns (counts, bin edges) of the held samples, as np.histogram does
+
+        :param bins: number of bins or the bin edges
+        :param range: (low, high) the bins cover, defaults to the samples' range
+        """
+        return np.histogram(self.values(), bins, range)
+
+    def summary(self, scale=1000, unit='ms'):
+        """
+        one line with p50/p90/p99/max, e.g. for printing every few seconds
+
+        :param scale: multiplier applied to the samples before printing (seconds -> ms by default)
+        :param unit: unit label
+        """
+        values = self.values()
+        if not len(values):
+            return "no samples"
+        p50, p90, p99 = np.percentile(values, (50, 90, 99)) * scale
+        return (f"p50 {p50:.1f} {unit}, p90 {p90:.1f} {unit}, p99 {p99:.1f} {unit}, "
+                f"max {values.max() * scale:.1f} {unit} ({len(values)} samples)")
+
+
+def format_histogram(counts, edges, scale=1000, unit='ms', width=40):
+    """
+    text bar chart of a histogram, one line per bin
+
+    :param scale: multiplier applied to the edges before printing (seconds -> ms by default)
+    :param unit: unit label
+    :param width: characters of the longest bar
+    """
+    most = max(counts.max(), 1) if len(counts) else 1
+    return '\n'.join(
+        f"{low * scale:8.2f}-{high * scale:8.2f} {unit} {count:>7} {'#' * int(width * count / most)}"
+        for low, high, count in zip(edges[:-1], edges[1:], counts)
+    )
+
+
+def prometheus_summary(name, stats, description, quantiles=(0.5, 0.9, 0.99)):
+    """
+    lines of Prometheus text exposition for a RingStats, quantiles are over the held samples
+
+    :param name: metric name, in base units
+    :param description: HELP text
+    """
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} summary"]
+    values = stats.percentiles([q * 100 for q in quantiles])
+    if values is not None:
+        lines += [f'{name}{{quantile="{q}"}} {value:.9g}' for q, value in zip(quantiles, values)]
+    lines += [f"{name}_sum {stats.total:.9g}", f"{name}_count {stats.count}"]
+    return lines
+
+
+class CallbackStats:
+    """
+    what every audio callback cost and what the stream reported
+
+    record() runs at the end of each callback and only writes into
+    preallocated rings and int counters. readers on other threads get
+    percentiles, histograms and a Prometheus-style text dump
+    """
+    def __init__(self, size=4096):
+        """
+        :param size: callbacks kept for the percentiles and histograms
+        """
+        # seconds spent mixing a block
+        self.compute = RingStats(size)
+        # seconds left before the block was due, negative means it was late
+        self.headroom = RingStats(size)
+        # seconds from the callback to its block reaching the DAC, outputBufferDacTime - currentTime
+        self.output_latency = RingStats(size)
+        self.xruns = dict.fromkeys(XRUN_FLAGS, 0)
+
+    def record(self, compute, deadline, time=None, status=None):
+        """
+        :param compute: seconds the callback took
+        :param deadline: seconds of audio in the block
+        :param time: the callback's time argument, None when called outside a stream
+        :param status: the callback's CallbackFlags
+        """
+        self.compute.add(compute)
+        self.headroom.add(deadline - compute)
+        if time is not None:
+            self.output_latency.add(time.outputBufferDacTime - time.currentTime)
+        if status:
+            for flag in XRUN_FLAGS:
+                if getattr(status, flag, False):
+                    self.xruns[flag] += 1
+
+    def report(self):
+        """a few lines for the log"""
+        xruns = ', '.join(f"{flag} {count}" for flag, count in self.xruns.items())
+        return (f"callback: {self.compute.summary(1e6, 'us')}\n"
+                f"headroom: {self.headroom.summary()}\n"
+                f"output latency: {self.output_latency.summary()}\n"
+                f"xruns: {xruns}")
+
+    def prometheus(self, prefix='mus277_audio'):
+        """this in Prometheus text exposition format"""
+        lines = prometheus_summary(f"{prefix}_callback_seconds", self.compute, "time spent mixing one block")
+        lines += prometheus_summary(f"{prefix}_headroom_seconds", self.headroom,
+                                    "time left before the block deadline, negative when late")
+        lines += prometheus_summary(f"{prefix}_output_latency_seconds", self.output_latency,
+                                    "time from the callback to the block reaching the DAC")
+        lines += [f"# HELP {prefix}_xruns_total stream status flags reported", f"# TYPE {prefix}_xruns_total counter"]
+        lines += [f'{prefix}_xruns_total{{flag="{flag}"}} {count}' for flag, count in self.xruns.items()]
+        return '\n'.join(lines) + '\n'
+
+
+def write_metrics(path, text):
+    """
+    replaces path with text in one step, so a scraper never reads half a file
+
+    :param path: e.g. a node_exporter textfile collector .prom file
+    :param text: from CallbackStats.prometheus or similar
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def serve_metrics(render, port=9277, host='127.0.0.1'):
+    """
+    serves render() as text on http://host:port/metrics from a daemon thread
+
+    :param render: function returning the metrics text, called per request
+    :return: the server, call shutdown() to stop it
+    """
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # a scrape every few seconds shouldn't end up in the log
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
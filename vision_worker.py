@@ -0,0 +1,269 @@
+import logging
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from poses import NUM_KEYPOINTS
+from rtlog import setup_logging
+from snapshot import LatestSnapshot, Snapshot
+from sources import is_camera
+
+log = logging.getLogger(__name__)
+
+# most people whose keypoints fit in the shared block, anyone past that is left out
+MAX_PEOPLE = 8
+# how often a waiting reader looks for a new frame
+POLL_INTERVAL = 0.002
+# seconds before restarting a crashed worker, doubled after every crash up to the max
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+# tries read makes at a frame that's being written before giving up, a live writer
+# finishes in microseconds, a dead one leaves the frame half written until recover()
+READ_ATTEMPTS = 100
+
+
+def block_layout(max_people):
+    """numpy dtype of the shared block, the same fixed layout in every process"""
+    return np.dtype([
+        ('seq', '<u8'),  # seqlock, odd while a frame is being written
+        ('timestamp', '<f8'),  # time.monotonic() of the capture, shared by all processes
+        ('people', '<u4'),
+        ('heights', '<u4'),
+        ('hand_heights', '<f4', (2 * max_people,)),
+        ('hand_x', '<f4', (2 * max_people,)),
+        ('poses', '<f4', (max_people, NUM_KEYPOINTS, 3)),
+    ])
+
+
+class SharedHands:
+    """
+    the newest frame's hand heights, keypoints and capture time in a multiprocessing.shared_memory block
+
+    one process publishes, any number read. a seqlock keeps readers from
+    seeing a half-written frame without either side taking a lock: the writer
+    makes seq odd, writes, then makes it even again, and a reader retries if seq
+    was odd or changed while it copied
+    """
+    def __init__(self, name=None, max_people=MAX_PEOPLE, create=False):
+        """
+        :param name: block to attach to, None with create=True picks a free name
+        :param max_people: must match the process that created the block
+        :param create: create (and later unlink) the block instead of attaching to it
+        """
+        layout = block_layout(max_people)
+        self.max_people = max_people
+        self.shm = shared_memory.SharedMemory(name, create=create, size=layout.itemsize)
+        self._owner = create
+        block = np.ndarray((), layout, buffer=self.shm.buf)
+        self._seq = block['seq']
+        self._timestamp = block['timestamp']
+        self._people = block['people']
+        self._heights = block['heights']
+        self._hand_heights = block['hand_heights']
+        self._hand_x = block['hand_x']
+        self._poses = block['poses']
+        if create:
+            self._seq[...] = 0
+        # readers copy into these, so reading never allocates
+        self._read_heights = np.zeros(2 * max_people, dtype=np.float32)
+        self._read_x = np.zeros(2 * max_people, dtype=np.float32)
+        self._read_poses = np.zeros((max_people, NUM_KEYPOINTS, 3), dtype=np.float32)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def recover(self):
+        """
+        lets a new writer take over from one that died mid-frame
+
+        the half-written frame is replaced by an empty one (nobody in view) before
+        it's published, readers never see the mix of old and new data
+        """
+        if int(self._seq) % 2:
+            self._timestamp[...] = time.monotonic()
+            self._heights[...] = 0
+            self._people[...] = 0
+            self._seq[...] = int(self._seq) + 1
+
+    def publish(self, hand_heights, timestamp, poses=None, hand_x=None):
+        """
+        writes one frame, only one process may do this
+
+        :param hand_heights: [L0, R0, L1, R1, ...]
+        :param timestamp: time.monotonic() the frame was captured
+        :param poses: (N, 17, 3) array, see poses.py
+        :param hand_x: horizontal positions in the same order as hand_heights, NaN (the default) for unknown
+        """
+        heights = min(len(hand_heights), len(self._hand_heights))
+        people = 0 if poses is None else min(len(poses), self.max_people)
+        seq = int(self._seq)
+        self._seq[...] = seq + 1
+        self._timestamp[...] = timestamp
+        self._heights[...] = heights
+        self._people[...] = people
+        self._hand_heights[:heights] = hand_heights[:heights]
+        self._hand_x[:heights] = np.nan if hand_x is None else hand_x[:heights]
+        if people:
+            self._poses[:people] = poses[:people]
+        self._seq[...] = seq + 2
+
+    def read(self):
+        """
+        returns the newest frame as a Snapshot, or None before the first one
+        or while the writer is stuck halfway through a frame
+
+        the snapshot's arrays are reused by the next read, copy them to keep them
+        """
+        for _ in range(READ_ATTEMPTS):
+            seq = int(self._seq)
+            if seq == 0:
+                return None
+            if seq % 2:
+                # the writer is a few microseconds into a frame, let other threads (and the GIL) have a turn
+                time.sleep(0)
+                continue
+            timestamp = float(self._timestamp)
+            heights = min(int(self._heights), len(self._read_heights))
+            people = min(int(self._people), self.max_people)
+            np.copyto(self._read_heights[:heights], self._hand_heights[:heights])
+            np.copyto(self._read_x[:heights], self._hand_x[:heights])
+            np.copyto(self._read_poses[:people], self._poses[:people])
+            if int(self._seq) == seq:
+                return Snapshot(seq // 2, timestamp, self._read_heights[:heights],
+                                poses=self._read_poses[:people], hand_x=self._read_x[:heights])
+        return None
+
+    def wait_newer(self, seq, timeout=None):
+        """
+        polls until a frame newer than seq is published, like LatestSnapshot.wait_newer
+
+        :param seq: sequence number of the last snapshot the caller has seen, 0 for none
+        :param timeout: seconds to wait at most
+        :return: the new Snapshot, or None on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if int(self._seq) // 2 > seq:
+                snapshot = self.read()
+                if snapshot is not None and snapshot.seq > seq:
+                    return snapshot
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def close(self):
+        """detaches, and frees the block if this process created it"""
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+class SharedPublisher(LatestSnapshot):
+    """LatestSnapshot that also writes every frame to a SharedHands block, for run_tracking in the worker"""
+    def __init__(self, hands):
+        super().__init__()
+        self.hands = hands
+        hands.recover()
+
+    def publish(self, hand_heights, timestamp=None, frame=None, poses=None, hand_x=None):
+        snapshot = super().publish(hand_heights, timestamp, frame, poses, hand_x)
+        self.hands.publish(hand_heights, snapshot.timestamp, poses, hand_x)
+        return snapshot
+
+
+def run_worker(name, max_people, model_settings, tracking_settings):
+    """entry point of the worker process"""
+    setup_logging()
+    hands = SharedHands(name, max_people)
+    # only the worker imports torch and the model
+    import controller
+    controller.start_model_loading(**model_settings)
+    controller.run_tracking(snapshots=SharedPublisher(hands), **tracking_settings)
+    hands.close()
+
+
+class VisionProcess:
+    """
+    runs controller.run_tracking in a separate process, so inference, drawing and
+    post-processing never hold the GIL the audio callback needs
+
+    results come back through a SharedHands block. a worker that dies with an
+    error is restarted, with a growing delay if it keeps crashing
+    """
+    def __init__(self, max_people=MAX_PEOPLE, backend=None, imgsz=None, threads=None, **tracking_settings):
+        """
+        :param max_people: see SharedHands
+        :param backend: see controller.start_model_loading
+        :param imgsz: see controller.start_model_loading
+        :param threads: see controller.start_model_loading
+        :param tracking_settings: keyword arguments for controller.run_tracking
+        """
+        self.hands = SharedHands(max_people=max_people, create=True)
+        self.model_settings = {'backend': backend, 'imgsz': imgsz, 'threads': threads}
+        self.tracking_settings = tracking_settings
+        self.restarts = 0
+        # a forked child would inherit the audio stream and every lock held by its threads
+        self._context = multiprocessing.get_context('spawn')
+        self._process = None
+        self._stopping = threading.Event()
+        self._supervisor = threading.Thread(target=self._supervise, name='vision-supervisor', daemon=True)
+
+    def _spawn(self):
+        self._process = self._context.Process(
+            target=run_worker, name='vision-worker', daemon=True,
+            args=(self.hands.name, self.hands.max_people, self.model_settings, self.tracking_settings),
+        )
+        self._process.start()
+
+    def _supervise(self):
+        delay = RESTART_DELAY
+        while True:
+            started = time.monotonic()
+            self._process.join()
+            if self._stopping.is_set():
+                return
+            # a camera that fails to deliver a frame ends tracking cleanly too, but unlike a file it comes back
+            if self._process.exitcode == 0 and not is_camera(self.tracking_settings.get('source', 0)):
+                log.info("Vision worker finished, the source ran out")
+                return
+            if time.monotonic() - started > MAX_RESTART_DELAY:
+                # it ran fine for a while, so this isn't a crash loop
+                delay = RESTART_DELAY
+            self.restarts += 1
+            log.error("Vision worker exited with code %s, restarting in %.0f s", self._process.exitcode, delay)
+            if self._stopping.wait(delay):
+                return
+            if self.tracking_settings.get('record'):
+                # the new worker carries on with the show's recording instead of starting it over
+                self.tracking_settings['append_record'] = True
+            self._spawn()
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    def start(self):
+        self._spawn()
+        self._supervisor.start()
+
+    def wait_newer(self, seq, timeout=None):
+        """see SharedHands.wait_newer"""
+        return self.hands.wait_newer(seq, timeout)
+
+    def latest(self):
+        """see SharedHands.read"""
+        return self.hands.read()
+
+    def stop(self, timeout=2.0):
+        """stops the worker and frees the shared block"""
+        self._stopping.set()
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join()
+        if self._supervisor.is_alive():
+            self._supervisor.join()
+        self.hands.close()